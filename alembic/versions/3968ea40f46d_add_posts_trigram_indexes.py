@@ -0,0 +1,28 @@
+"""add posts trigram indexes
+
+Revision ID: 3968ea40f46d
+Revises: 5f2191f42a19
+Create Date: 2026-10-18 10:58:13.894470
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '3968ea40f46d'
+down_revision: Union[str, None] = '5f2191f42a19'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.create_index('ix_posts_title_trgm', 'posts', ['title'], postgresql_using='gin', postgresql_ops={'title': 'gin_trgm_ops'})
+    op.create_index('ix_posts_content_trgm', 'posts', ['content'], postgresql_using='gin', postgresql_ops={'content': 'gin_trgm_ops'})
+
+
+def downgrade() -> None:
+    op.drop_index('ix_posts_content_trgm', table_name='posts')
+    op.drop_index('ix_posts_title_trgm', table_name='posts')
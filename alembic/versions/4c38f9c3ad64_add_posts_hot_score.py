@@ -0,0 +1,34 @@
+"""add posts hot_score
+
+Revision ID: 4c38f9c3ad64
+Revises: 3968ea40f46d
+Create Date: 2026-10-18 12:14:52.318207
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '4c38f9c3ad64'
+down_revision: Union[str, None] = '3968ea40f46d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('posts', sa.Column('hot_score', sa.Float(), server_default='0', nullable=False))
+    # posts outside the default 7 day window stay at 0, as decay-hot-scores would leave them
+    op.execute("""
+        UPDATE posts SET hot_score = votes_count / power(extract(epoch FROM now() - created_at) / 3600 + 2, 1.8)
+        WHERE votes_count > 0 AND created_at >= now() - interval '7 days'
+    """)
+    op.create_index('ix_posts_hot_score_id', 'posts', ['hot_score', 'id'])
+    op.create_index('ix_posts_votes_count_id', 'posts', ['votes_count', 'id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_posts_votes_count_id', table_name='posts')
+    op.drop_index('ix_posts_hot_score_id', table_name='posts')
+    op.drop_column('posts', 'hot_score')
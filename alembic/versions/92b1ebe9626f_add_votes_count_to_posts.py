@@ -0,0 +1,30 @@
+"""add votes_count to posts
+
+Revision ID: 92b1ebe9626f
+Revises: c3d1e86afda9
+Create Date: 2026-10-18 10:02:37.540912
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '92b1ebe9626f'
+down_revision: Union[str, None] = 'c3d1e86afda9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('posts', sa.Column('votes_count', sa.Integer(), server_default='0', nullable=False))
+    op.execute("""
+        UPDATE posts SET votes_count = counts.votes
+        FROM (SELECT post_id, count(*) AS votes FROM votes GROUP BY post_id) AS counts
+        WHERE posts.id = counts.post_id
+    """)
+
+
+def downgrade() -> None:
+    op.drop_column('posts', 'votes_count')
@@ -0,0 +1,27 @@
+"""add posts updated_at
+
+Revision ID: bc9e0d16589a
+Revises: d7e94f7d9551
+Create Date: 2026-10-18 18:29:26.808164
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'bc9e0d16589a'
+down_revision: Union[str, None] = 'd7e94f7d9551'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # now() is stable, so existing rows take the default without a table rewrite
+    op.add_column('posts', sa.Column('updated_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('posts', 'updated_at')
@@ -0,0 +1,25 @@
+"""add posts created_at id index
+
+Revision ID: c3d1e86afda9
+Revises: 347e169ee44f
+Create Date: 2026-10-18 09:12:04.118203
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = 'c3d1e86afda9'
+down_revision: Union[str, None] = '347e169ee44f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index("ix_posts_created_at_id", "posts", ["created_at", "id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_posts_created_at_id", table_name="posts")
@@ -0,0 +1,51 @@
+"""add follows and timeline_entries
+
+Revision ID: c919f7ad3736
+Revises: 4c38f9c3ad64
+Create Date: 2026-10-18 13:05:21.774630
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = 'c919f7ad3736'
+down_revision: Union[str, None] = '4c38f9c3ad64'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('followers_count', sa.Integer(), server_default='0', nullable=False))
+    op.create_table('follows',
+                    sa.Column('follower_id', sa.Integer(), nullable=False),
+                    sa.Column('followee_id', sa.Integer(), nullable=False),
+                    sa.Column('created_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+                    sa.ForeignKeyConstraint(['follower_id'], ['users.id'], ondelete='CASCADE'),
+                    sa.ForeignKeyConstraint(['followee_id'], ['users.id'], ondelete='CASCADE'),
+                    sa.PrimaryKeyConstraint('follower_id', 'followee_id')
+                    )
+    op.create_index('ix_follows_followee_id', 'follows', ['followee_id'])
+    op.create_table('timeline_entries',
+                    sa.Column('user_id', sa.Integer(), nullable=False),
+                    sa.Column('post_id', sa.Integer(), nullable=False),
+                    sa.Column('created_at', sa.TIMESTAMP(timezone=True), nullable=False),
+                    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+                    sa.ForeignKeyConstraint(['post_id'], ['posts.id'], ondelete='CASCADE'),
+                    sa.PrimaryKeyConstraint('user_id', 'post_id')
+                    )
+    op.create_index('ix_timeline_entries_user_id_created_at_post_id', 'timeline_entries', ['user_id', 'created_at', 'post_id'])
+    op.create_index('ix_timeline_entries_post_id', 'timeline_entries', ['post_id'])
+    op.create_index('ix_posts_owner_id_created_at_id', 'posts', ['owner_id', 'created_at', 'id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_posts_owner_id_created_at_id', table_name='posts')
+    op.drop_index('ix_timeline_entries_post_id', table_name='timeline_entries')
+    op.drop_index('ix_timeline_entries_user_id_created_at_post_id', table_name='timeline_entries')
+    op.drop_table('timeline_entries')
+    op.drop_index('ix_follows_followee_id', table_name='follows')
+    op.drop_table('follows')
+    op.drop_column('users', 'followers_count')
@@ -0,0 +1,34 @@
+"""add votes post_id index
+
+Revision ID: d7e94f7d9551
+Revises: c919f7ad3736
+Create Date: 2026-10-18 18:27:02.307688
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd7e94f7d9551'
+down_revision: Union[str, None] = 'c919f7ad3736'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# posts.owner_id and posts.created_at are already the leading columns of
+# ix_posts_owner_id_created_at_id and ix_posts_created_at_id, and votes.user_id leads the
+# primary key. votes.post_id was the one foreign key with no index: counting a post's votes
+# and the ON DELETE CASCADE from posts scanned the whole votes table.
+# CONCURRENTLY can't run inside a transaction, and doesn't block writes to votes while it builds.
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index('ix_votes_post_id', 'votes', ['post_id'], postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_votes_post_id', table_name='votes', postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,141 @@
+import asyncio
+import math
+import time
+from collections import deque
+from fastapi import Request, HTTPException, status, Depends
+from fastapi.responses import JSONResponse
+from . import metrics, oauth2
+from .cache import TTLCache
+from .config import settings
+from .database import is_write
+
+# Admission control. Every request takes a slot of its class (auth, write or read) before it
+# runs. When all slots are busy it waits in a bounded FIFO queue; it is shed with a 503 when
+# the queue is full, when its expected wait exceeds admission_max_wait_seconds, or when it
+# has waited that long. Shedding early keeps the admitted requests fast instead of letting
+# every request time out. Per-user token buckets additionally cap votes and new posts.
+
+admission_shed = metrics.Counter("admission_shed_total", "Requests rejected by admission control, by class and reason")
+rate_limited = metrics.Counter("rate_limited_total", "Requests rejected by per-user rate limits, by limit")
+
+class Shed(Exception):
+    def __init__(self, reason: str, retry_after: float):
+        self.reason = reason
+        self.retry_after = retry_after
+
+class ConcurrencyLimiter:
+    def __init__(self, name: str, limit: int, queue_size: int, max_wait: float):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self.active = 0
+        self.waiters = deque()
+        # moving average of how long an admitted request holds its slot
+        self.service_seconds = 0.0
+
+    def expected_wait(self, position: int):
+        # the queue drains `limit` requests at a time
+        return math.ceil(position / self.limit) * self.service_seconds
+
+    async def acquire(self):
+        if self.active < self.limit and not self.waiters:
+            self.active += 1
+            return
+        if len(self.waiters) >= self.queue_size:
+            raise Shed("queue_full", self.expected_wait(len(self.waiters)))
+        if self.expected_wait(len(self.waiters) + 1) > self.max_wait:
+            raise Shed("deadline", self.expected_wait(len(self.waiters) + 1))
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.append(future)
+        try:
+            await asyncio.wait_for(future, self.max_wait)
+        except BaseException as error:
+            if future.done() and not future.cancelled():
+                # a slot was handed over just as we gave up
+                self.release()
+            elif future in self.waiters:
+                self.waiters.remove(future)
+            if isinstance(error, asyncio.TimeoutError):
+                raise Shed("timeout", self.max_wait)
+            raise
+
+    def release(self):
+        # hand the slot straight to the next waiter, if any is still waiting
+        while self.waiters:
+            future = self.waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    def observe(self, seconds: float):
+        self.service_seconds = seconds if not self.service_seconds else 0.9 * self.service_seconds + 0.1 * seconds
+
+limiters = {
+    "auth": ConcurrencyLimiter("auth", settings.admission_auth_limit, settings.admission_auth_queue, settings.admission_max_wait_seconds),
+    "write": ConcurrencyLimiter("write", settings.admission_write_limit, settings.admission_write_queue, settings.admission_max_wait_seconds),
+    "read": ConcurrencyLimiter("read", settings.admission_read_limit, settings.admission_read_queue, settings.admission_max_wait_seconds),
+}
+
+metrics.Gauge("admission_in_flight", "Requests holding an admission slot, by class", lambda: {(("class", name),): limiter.active for name, limiter in limiters.items()})
+metrics.Gauge("admission_queued", "Requests waiting for an admission slot, by class", lambda: {(("class", name),): len(limiter.waiters) for name, limiter in limiters.items()})
+
+def request_class(request: Request):
+    path = request.url.path
+    # scrapes must get through an overloaded worker; CORS preflights never reach a route
+    if path == "/metrics" or path.startswith("/metrics/") or request.method == "OPTIONS":
+        return None
+    # both run bcrypt
+    if request.method == "POST" and path.rstrip("/") in ("/login", "/users"):
+        return "auth"
+    return "write" if is_write(request) else "read"
+
+async def admission_control(request: Request, call_next):
+    name = request_class(request)
+    if name is None or not settings.admission_enabled:
+        return await call_next(request)
+    limiter = limiters[name]
+    try:
+        await limiter.acquire()
+    except Shed as shed:
+        admission_shed.inc(**{"class": name, "reason": shed.reason})
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={"detail": "Server is overloaded, try again later"}, headers={"Retry-After": str(max(1, math.ceil(shed.retry_after)))})
+    start = time.perf_counter()
+    try:
+        return await call_next(request)
+    finally:
+        limiter.observe(time.perf_counter() - start)
+        limiter.release()
+
+class TokenBucket:
+    # per-user buckets of `burst` tokens refilled at `rate` per second. A bucket left alone
+    # long enough to refill is the same as a new one, so idle users are simply forgotten.
+    def __init__(self, name: str, rate: float, burst: int):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.buckets = TTLCache(maxsize=100000, ttl=burst / rate)
+
+    def take(self, key, cost: int = 1):
+        # cost must not exceed burst, or the bucket never holds enough; callers bound their requests
+        now = time.monotonic()
+        tokens, updated_at = self.buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+        if tokens < cost:
+            rate_limited.inc(limit=self.name)
+            raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=f"Too many {self.name}, slow down", headers={"Retry-After": str(max(1, math.ceil((cost - tokens) / self.rate)))})
+        self.buckets.set(key, (tokens - cost, now))
+
+vote_bucket = TokenBucket("votes", settings.vote_rate_per_second, settings.vote_burst)
+post_bucket = TokenBucket("posts", settings.post_rate_per_second, settings.post_burst)
+bulk_post_bucket = TokenBucket("bulk imports", settings.bulk_post_rate_per_second, settings.bulk_post_burst)
+
+async def limit_votes(current_user = Depends(oauth2.get_current_user)):
+    vote_bucket.take(current_user.id)
+
+async def limit_posts(current_user = Depends(oauth2.get_current_user)):
+    post_bucket.take(current_user.id)
+
+async def limit_bulk_posts(current_user = Depends(oauth2.get_current_user)):
+    bulk_post_bucket.take(current_user.id)
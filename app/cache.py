@@ -0,0 +1,190 @@
+import json
+import time
+from collections import OrderedDict, defaultdict
+from urllib.parse import urlencode
+from fastapi import Response
+from .config import settings
+from . import metrics
+
+class TTLCache:
+    # Bounded LRU map whose entries also expire `ttl` seconds after they were set.
+    # Used from the event loop only, so it takes no locks.
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is None:
+            return default
+        value, expires_at = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl: float = None):
+        self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key):
+        item = self._data.pop(key, None)
+        return item[0] if item else None
+
+    def pop_where(self, predicate):
+        keys = [key for key in self._data if predicate(key)]
+        for key in keys:
+            del self._data[key]
+        return len(keys)
+
+    def __contains__(self, key):
+        # unlike get, neither refreshes the LRU position nor drops expired entries
+        item = self._data.get(key)
+        return item is not None and item[1] >= time.monotonic()
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+# Response cache. Entries are stored as bytes under a key built from the route and its
+# normalized query params, and are tagged (e.g. "feed", "post:12") so writes can evict
+# exactly the entries they affect.
+
+# shared backends are seen by every worker, so a write evicting its entries is enough for all of them
+
+class NullBackend:
+    shared = False
+
+    async def get(self, key: str):
+        return None
+
+    async def set(self, key: str, value: bytes, tags):
+        pass
+
+    async def invalidate(self, tags):
+        pass
+
+    async def clear(self):
+        pass
+
+class MemoryBackend:
+    shared = False
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.tags = defaultdict(set)
+
+    async def get(self, key: str):
+        return self.entries.get(key)
+
+    async def set(self, key: str, value: bytes, tags):
+        self.entries.set(key, value)
+        for tag in tags:
+            self.tags[tag].add(key)
+        if sum(len(keys) for keys in self.tags.values()) > 8 * self.entries.maxsize:
+            # forget keys that expired or were evicted since they were tagged
+            for tag in list(self.tags):
+                self.tags[tag] = {key for key in self.tags[tag] if key in self.entries}
+                if not self.tags[tag]:
+                    del self.tags[tag]
+
+    async def invalidate(self, tags):
+        for tag in tags:
+            for key in self.tags.pop(tag, ()):
+                self.entries.pop(key)
+
+    async def clear(self):
+        self.entries.clear()
+        self.tags.clear()
+
+class RedisBackend:
+    # Works with anything speaking the redis.asyncio client API, e.g. fakeredis in tests.
+    shared = True
+
+    def __init__(self, ttl: float, url: str = None, client=None, prefix: str = "responses:"):
+        if client is None:
+            import redis.asyncio
+            client = redis.asyncio.Redis.from_url(url)
+        self.client = client
+        self.ttl_ms = int(ttl * 1000)
+        self.prefix = prefix
+
+    async def get(self, key: str):
+        return await self.client.get(self.prefix + key)
+
+    async def set(self, key: str, value: bytes, tags):
+        pipe = self.client.pipeline(transaction=False)
+        pipe.set(self.prefix + key, value, px=self.ttl_ms)
+        for tag in tags:
+            pipe.sadd(self.prefix + "tag:" + tag, self.prefix + key)
+            pipe.pexpire(self.prefix + "tag:" + tag, self.ttl_ms)
+        await pipe.execute()
+
+    async def invalidate(self, tags):
+        tag_keys = [self.prefix + "tag:" + tag for tag in tags]
+        pipe = self.client.pipeline(transaction=False)
+        for tag_key in tag_keys:
+            pipe.smembers(tag_key)
+        if tag_keys:
+            keys = set().union(*await pipe.execute())
+            await self.client.delete(*keys, *tag_keys)
+
+    async def clear(self):
+        # only this backend's keys; SCAN rather than KEYS so redis keeps serving while it walks them
+        keys = []
+        async for key in self.client.scan_iter(match=self.prefix + "*", count=1000):
+            keys.append(key)
+            if len(keys) == 1000:
+                await self.client.delete(*keys)
+                keys = []
+        if keys:
+            await self.client.delete(*keys)
+
+def make_backend(settings):
+    if settings.response_cache_backend == "memory":
+        return MemoryBackend(maxsize=settings.response_cache_size, ttl=settings.response_cache_ttl_seconds)
+    if settings.response_cache_backend == "redis":
+        return RedisBackend(ttl=settings.response_cache_ttl_seconds, url=settings.redis_url)
+    return NullBackend()
+
+response_cache_requests = metrics.Counter("response_cache_requests_total", "Response cache lookups by route and result")
+
+class ResponseCache:
+    def __init__(self, backend):
+        self.backend = backend
+
+    @staticmethod
+    def key(route: str, **params):
+        return route + "?" + urlencode(sorted(params.items()))
+
+    async def get(self, route: str, key: str):
+        value = await self.backend.get(key)
+        response_cache_requests.inc(route=route, result="miss" if value is None else "hit")
+        if value is None:
+            return None
+        headers, body = value.split(b"\n", 1)
+        return Response(content=body, media_type="application/json", headers=json.loads(headers))
+
+    async def set(self, key: str, body: bytes, tags, headers: dict = None):
+        await self.backend.set(key, json.dumps(headers or {}).encode() + b"\n" + body, tags)
+
+    async def invalidate(self, *tags):
+        await self.backend.invalidate(tags)
+
+    async def clear(self):
+        await self.backend.clear()
+
+response_cache = ResponseCache(make_backend(settings))
+
+def cache_stats():
+    stats = {}
+    for labels, value in response_cache_requests.snapshot().items():
+        labels = dict(labels)
+        stats.setdefault(labels["route"], {"hit": 0, "miss": 0})[labels["result"]] = int(value)
+    return {"backend": settings.response_cache_backend, "routes": stats}
@@ -0,0 +1,69 @@
+import argparse
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, update, func, tuple_
+from . import models
+from .config import settings
+from .database import SessionLocal
+from .votes import hot_score
+
+# Maintenance commands, run with `python -m app.commands <command>`.
+
+def reconcile_votes(batch_size: int = 1000):
+    # posts.votes_count is maintained by the vote endpoints; this recomputes it from
+    # the votes table one id range at a time so no single transaction locks every post.
+    vote_count = select(func.count()).where(models.Vote.post_id == models.Post.id).scalar_subquery()
+    fixed = 0
+    last_id = 0
+    with SessionLocal() as db:
+        while True:
+            ids = db.scalars(select(models.Post.id).where(models.Post.id > last_id).order_by(models.Post.id).limit(batch_size)).all()
+            if not ids:
+                break
+            result = db.execute(update(models.Post).where(models.Post.id.between(ids[0], ids[-1]), models.Post.votes_count != vote_count).values(votes_count=vote_count, hot_score=hot_score(vote_count, models.Post.created_at), updated_at=func.now()))
+            db.commit()
+            fixed += result.rowcount
+            last_id = ids[-1]
+    return fixed
+
+def decay_hot_scores(batch_size: int = 1000, window_days: float = None):
+    # Meant to run from cron every few minutes. Posts that aged out of the window drop to 0,
+    # recent posts with votes get their score recomputed for their current age.
+    cutoff = datetime.now(timezone.utc) - timedelta(days=settings.hot_window_days if window_days is None else window_days)
+    updated = 0
+    with SessionLocal() as db:
+        while True:
+            # walks ix_posts_hot_score_id, so only posts that still have a score are visited
+            ids = db.scalars(select(models.Post.id).where(models.Post.hot_score > 0, models.Post.created_at < cutoff).limit(batch_size)).all()
+            if not ids:
+                break
+            updated += db.execute(update(models.Post).where(models.Post.id.in_(ids)).values(hot_score=0)).rowcount
+            db.commit()
+        last = (cutoff, 0)
+        while True:
+            # keyset walk over ix_posts_created_at_id, one batch per transaction
+            rows = db.execute(select(models.Post.created_at, models.Post.id).where(tuple_(models.Post.created_at, models.Post.id) > last).order_by(models.Post.created_at, models.Post.id).limit(batch_size)).all()
+            if not rows:
+                break
+            result = db.execute(update(models.Post).where(models.Post.id.in_([row.id for row in rows]), models.Post.votes_count > 0).values(hot_score=hot_score(models.Post.votes_count, models.Post.created_at)))
+            db.commit()
+            updated += result.rowcount
+            last = tuple(rows[-1])
+    return updated
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m app.commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    reconcile = subparsers.add_parser("reconcile-votes", help="recompute drifted posts.votes_count counters")
+    reconcile.add_argument("--batch-size", type=int, default=1000)
+    decay = subparsers.add_parser("decay-hot-scores", help="recompute posts.hot_score for the current time")
+    decay.add_argument("--batch-size", type=int, default=1000)
+    decay.add_argument("--window-days", type=float, default=None)
+    args = parser.parse_args()
+
+    if args.command == "reconcile-votes":
+        print(f"reconciled {reconcile_votes(args.batch_size)} posts")
+    elif args.command == "decay-hot-scores":
+        print(f"updated {decay_hot_scores(args.batch_size, args.window_days)} hot scores")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from fastapi import Request, Response, status
+
+# Conditional GETs. Posts carry updated_at, bumped by edits and votes, so a post's version is
+# (id, updated_at) and a page's version is a hash of the versions of its rows. A client that
+# sends back the ETag (or Last-Modified) it last saw gets a bodyless 304 while nothing changed.
+
+def post_headers(id: int, updated_at: datetime):
+    return {
+        "ETag": f'"{id}-{int(updated_at.timestamp() * 1_000_000)}"',
+        "Last-Modified": format_datetime(updated_at.astimezone(timezone.utc), usegmt=True),
+    }
+
+def page_headers(versions, variant: str = ""):
+    # versions: (id, updated_at) of the rows on the page, in page order. variant tells apart
+    # different representations of the same rows, e.g. sparse fieldsets.
+    digest = hashlib.blake2b(digest_size=12)
+    digest.update(variant.encode() + b"|")
+    for id, updated_at in versions:
+        digest.update(f"{id}-{int(updated_at.timestamp() * 1_000_000)};".encode())
+    return {"ETag": f'"{digest.hexdigest()}"'}
+
+def is_conditional(request: Request):
+    return "if-none-match" in request.headers or "if-modified-since" in request.headers
+
+def _etags(header: str):
+    # weak comparison, as for GET: W/"x" matches "x"
+    return {tag.strip().removeprefix("W/") for tag in header.split(",")}
+
+def _http_date(value: str):
+    try:
+        return parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+def is_fresh(request: Request, headers):
+    # headers: the ETag / Last-Modified the full response would carry. If-None-Match wins over
+    # If-Modified-Since when both are sent; an unparseable date is ignored.
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        etag = headers.get("ETag")
+        return etag is not None and (if_none_match.strip() == "*" or etag in _etags(if_none_match))
+    since, last_modified = _http_date(request.headers.get("if-modified-since")), _http_date(headers.get("Last-Modified"))
+    return since is not None and last_modified is not None and since.tzinfo is not None and last_modified <= since
+
+def not_modified(headers):
+    # headers may come from a cached full response; a 304 carries no body to describe
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={key: value for key, value in headers.items() if key.lower() not in ("content-length", "content-type")})
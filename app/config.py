@@ -1,3 +1,4 @@
+from typing import List, Literal, Optional
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
@@ -7,9 +8,74 @@ class Settings(BaseSettings):
     database_port: str
     database_username:str
     database_password: str
+    # overrides the URL built from the settings above, e.g. to point benchmarks at a scratch database
+    database_url: Optional[str] = None
+    database_pool_size: int = 5
+    database_max_overflow: int = 10
+    database_pool_timeout: float = 30
+    database_pool_recycle: int = 1800
+    database_pool_pre_ping: bool = True
+    # behind PgBouncer in transaction mode: no app-side pool and no prepared statements
+    database_pgbouncer: bool = False
+    # compiled SQL kept per engine by SQLAlchemy, and prepared statements kept per connection by asyncpg
+    database_query_cache_size: int = 1200
+    database_prepared_statement_cache_size: int = 256
+    # read replicas for GET routes, as a JSON list of DSNs; the credentials are part of each DSN
+    database_replica_urls: List[str] = []
+    database_replica_check_interval: float = 5
+    # reads within this many seconds of the client's own last write go to the primary
+    read_your_writes_seconds: float = 5
     secret_key: str
     algorithm: str
     access_token_expire_minutes: int
+    bcrypt_rounds: int = 12
+    password_hash_workers: int = 2
+    password_hash_queue_size: int = 32
+    response_cache_backend: Literal["none", "memory", "redis"] = "memory"
+    response_cache_size: int = 1000
+    response_cache_ttl_seconds: float = 10
+    # only the first few pages of GET /posts are cached
+    response_cache_feed_pages: int = 3
+    # hot feed: votes / (age in hours + 2) ^ gravity, for posts younger than the window
+    hot_gravity: float = 1.8
+    hot_window_days: float = 7
+    # authors with more followers than this are not fanned out on write; timelines pull their posts on read
+    timeline_fanout_max_followers: int = 10000
+    # posts of a newly followed account copied into the follower's timeline
+    timeline_backfill_posts: int = 20
+    # concurrent requests per class, and how many more may queue for a slot
+    admission_enabled: bool = True
+    admission_auth_limit: int = 8
+    admission_auth_queue: int = 32
+    admission_write_limit: int = 32
+    admission_write_queue: int = 128
+    admission_read_limit: int = 64
+    admission_read_queue: int = 256
+    admission_max_wait_seconds: float = 2
+    # per-user token buckets: sustained rate and burst size
+    vote_rate_per_second: float = 5
+    vote_burst: int = 30
+    post_rate_per_second: float = 0.2
+    post_burst: int = 10
+    # POST /posts/bulk is an import tool: charged per request, from a bucket of its own
+    bulk_post_rate_per_second: float = 0.05
+    bulk_post_burst: int = 5
+    # publish cache invalidations with NOTIFY and listen for other workers' ones
+    cache_invalidation_enabled: bool = True
+    # LISTEN needs a session, so point this past a PgBouncer in transaction mode
+    cache_invalidation_listen_url: Optional[str] = None
+    vote_buffer_enabled: bool = False
+    # how long the first vote of a flush waits for others to join it; vote requests wait for their flush
+    vote_buffer_flush_seconds: float = 0.01
+    vote_buffer_flush_size: int = 1000
+    vote_buffer_max_votes: int = 50000
+    # requests taking longer are logged with their SQL statements
+    slow_request_seconds: float = 1.0
+    redis_url: str = "redis://localhost:6379/0"
+    principal_cache_size: int = 10000
+    principal_cache_ttl_seconds: float = 60
+    # embed the user's email and created_at in tokens and skip the users lookup entirely
+    auth_trust_token_claims: bool = False
     
     model_config = SettingsConfigDict(env_file=".env")
     
@@ -1,19 +1,176 @@
-from sqlalchemy import create_engine
+import asyncio
+import itertools
+import time
+from uuid import uuid4
+from fastapi import Request
+from sqlalchemy import create_engine, text, make_url, exc
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool
 from .config import settings
+from . import metrics, instrumentation
 
 SQLALCHEMY_DATABASE_URL = f'postgresql://{settings.database_username}:{settings.database_password}@{settings.database_hostname}:{settings.database_port}/{settings.database_name}'
+ASYNC_SQLALCHEMY_DATABASE_URL = f'postgresql+asyncpg://{settings.database_username}:{settings.database_password}@{settings.database_hostname}:{settings.database_port}/{settings.database_name}'
+if settings.database_url:
+    SQLALCHEMY_DATABASE_URL = make_url(settings.database_url).set(drivername="postgresql").render_as_string(hide_password=False)
+    ASYNC_SQLALCHEMY_DATABASE_URL = make_url(settings.database_url).set(drivername="postgresql+asyncpg").render_as_string(hide_password=False)
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    # records how long each checkout waited for a free (or newly opened) connection
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            metrics.pool_wait_seconds.observe(time.perf_counter() - start)
+
+def engine_options():
+    if settings.database_pgbouncer:
+        # PgBouncer owns the pool; asyncpg must not cache prepared statements across transactions,
+        # and the ones it still prepares need unique names: its own counter restarts with every
+        # client connection, so two of them could collide on the same server connection
+        return {"poolclass": NullPool, "query_cache_size": settings.database_query_cache_size, "connect_args": {
+            "statement_cache_size": 0,
+            "prepared_statement_cache_size": 0,
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__",
+        }}
+    return {
+        "poolclass": TimedQueuePool,
+        "query_cache_size": settings.database_query_cache_size,
+        # statements are prepared server side once per connection and reused by later executions
+        "connect_args": {"prepared_statement_cache_size": settings.database_prepared_statement_cache_size},
+        "pool_size": settings.database_pool_size,
+        "max_overflow": settings.database_max_overflow,
+        "pool_timeout": settings.database_pool_timeout,
+        "pool_recycle": settings.database_pool_recycle,
+        "pool_pre_ping": settings.database_pool_pre_ping,
+    }
+
+# The sync engine is kept for Alembic, maintenance commands and benchmarks; routes use the async one.
+engine = create_engine(SQLALCHEMY_DATABASE_URL, pool_pre_ping=settings.database_pool_pre_ping)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, **engine_options())
+instrumentation.instrument_engine(async_engine.sync_engine)
+
+# objects stay usable after commit; lazy loads would need IO outside of an await
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
\ No newline at end of file
+
+class ReplicaSet:
+    # Round-robin over the healthy replicas. A background task pings each one every
+    # database_replica_check_interval seconds; a replica that fails a ping or a request is
+    # skipped until it answers again, and reads fall back to the primary when none is healthy.
+    def __init__(self, urls):
+        self.engines = [create_async_engine(make_url(url).set(drivername="postgresql+asyncpg"), **engine_options()) for url in urls]
+        for engine in self.engines:
+            instrumentation.instrument_engine(engine.sync_engine)
+        self.healthy = {engine: True for engine in self.engines}
+        self._turn = itertools.count()
+        self._task = None
+
+    def pick(self):
+        healthy = [engine for engine in self.engines if self.healthy[engine]]
+        return healthy[next(self._turn) % len(healthy)] if healthy else None
+
+    def mark_down(self, engine):
+        self.healthy[engine] = False
+
+    async def _ping(self, engine):
+        async with engine.connect() as connection:
+            await connection.execute(text("SELECT 1"))
+
+    async def check(self):
+        for engine in self.engines:
+            try:
+                await asyncio.wait_for(self._ping(engine), timeout=settings.database_replica_check_interval)
+                self.healthy[engine] = True
+            except Exception:
+                self.healthy[engine] = False
+
+    async def _run(self):
+        while True:
+            await self.check()
+            await asyncio.sleep(settings.database_replica_check_interval)
+
+    def start(self):
+        if self.engines and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for engine in self.engines:
+            await engine.dispose()
+
+replicas = ReplicaSet(settings.database_replica_urls)
+
+# failures that mean the replica itself is unreachable, rather than a bad query
+REPLICA_DOWN_ERRORS = (exc.OperationalError, exc.InterfaceError, OSError)
+
+# POST routes that only read, because their arguments don't fit in a query string
+READ_ONLY_POSTS = {"/posts/lookup"}
+
+def is_write(request: Request):
+    if request.method == "POST":
+        return request.url.path.rstrip("/") not in READ_ONLY_POSTS
+    return request.method not in ("GET", "HEAD", "OPTIONS")
+
+def recent_write(request: Request):
+    # set by the remember_writes middleware after every successful write, as a cookie and a header
+    last_write = request.headers.get("X-Last-Write") or request.cookies.get("last_write")
+    try:
+        age = time.time() - float(last_write)
+    except (TypeError, ValueError):
+        return False
+    return 0 <= age < settings.read_your_writes_seconds
+
+def read_session(request: Request):
+    # a replica, or the primary when there is none or the client has just written
+    read_your_writes = bool(replicas.engines) and recent_write(request)
+    engine = None if read_your_writes else replicas.pick()
+    db = AsyncSessionLocal(bind=engine) if engine is not None else AsyncSessionLocal()
+    db.info["replica"] = engine
+    # a replica read may have re-cached a response older than the client's own write
+    db.info["read_your_writes"] = read_your_writes
+    return db
+
+async def get_read_db(request: Request):
+    # for read-only routes; writes must keep using get_db
+    async with read_session(request) as db:
+        try:
+            yield db
+        except REPLICA_DOWN_ERRORS:
+            if db.info["replica"] is not None:
+                replicas.mark_down(db.info["replica"])
+            raise
+
+def _pool_gauge(read):
+    def collect():
+        pools = [(("database", "primary"), async_engine.pool)] + [(("database", f"{engine.url.host}:{engine.url.port}"), engine.pool) for engine in replicas.engines]
+        return {(label,): read(pool) for label, pool in pools if isinstance(pool, AsyncAdaptedQueuePool)}
+    return collect
+
+metrics.Gauge("db_pool_checked_out", "Connections currently checked out of the pool", _pool_gauge(lambda pool: pool.checkedout()))
+metrics.Gauge("db_pool_checked_in", "Idle connections in the pool", _pool_gauge(lambda pool: pool.checkedin()))
+metrics.Gauge("db_replica_healthy", "Whether a read replica passed its last health check", lambda: {(("database", f"{engine.url.host}:{engine.url.port}"),): int(healthy) for engine, healthy in replicas.healthy.items()})
+
+def pool_stats():
+    pool = async_engine.pool
+    stats = {"status": pool.status()}
+    if isinstance(pool, AsyncAdaptedQueuePool):
+        stats.update(size=pool.size(), checked_in=pool.checkedin(), checked_out=pool.checkedout(), overflow=max(pool.overflow(), 0))
+    wait = metrics.pool_wait_seconds.snapshot().get((), {"count": 0, "sum": 0.0, "max": 0.0})
+    stats["wait"] = {"checkouts": wait["count"], "total_seconds": wait["sum"], "max_seconds": wait["max"]}
+    stats["replicas"] = [{"host": engine.url.host, "port": engine.url.port, "healthy": replicas.healthy[engine], "status": engine.pool.status()} for engine in replicas.engines]
+    return stats
@@ -0,0 +1,99 @@
+import codecs
+import json
+
+# Incremental parsing of request bodies for bulk endpoints, so items can be validated and
+# written while the rest of the body is still arriving. Accepts a JSON array or NDJSON.
+
+# largest single item we are willing to buffer while waiting for the rest of it
+MAX_ITEM_BYTES = 1024 * 1024
+
+class MalformedBody(ValueError):
+    pass
+
+async def _text(chunks):
+    # decodes incrementally so multi-byte characters split across chunks survive
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    async for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+async def iter_ndjson(chunks):
+    # yields (item, error) per non-blank line; a bad line is reported and skipped
+    buffer = ""
+    async for text in _text(chunks):
+        buffer += text
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            if line.strip():
+                yield _load_line(line)
+        if len(buffer) > MAX_ITEM_BYTES:
+            raise MalformedBody("line too long")
+    if buffer.strip():
+        yield _load_line(buffer)
+
+def _load_line(line: str):
+    try:
+        return json.loads(line), None
+    except ValueError as error:
+        return None, f"invalid JSON: {error}"
+
+async def iter_json_array(chunks):
+    # yields (item, None) per element of a top-level array; anything that breaks the
+    # structure of the array raises MalformedBody since later items can't be located
+    decoder = json.JSONDecoder()
+    buffer, pos, state = "", 0, "start"
+    texts = _text(chunks)
+    eof = False
+    while True:
+        while pos < len(buffer) and buffer[pos].isspace():
+            pos += 1
+        if pos == len(buffer):
+            if eof:
+                raise MalformedBody("unexpected end of body")
+            buffer, pos = "", 0
+            try:
+                buffer = await texts.__anext__()
+            except StopAsyncIteration:
+                eof = True
+            continue
+        char = buffer[pos]
+        if state == "start":
+            if char != "[":
+                raise MalformedBody("expected a JSON array")
+            pos, state = pos + 1, "first"
+        elif char == "]" and state in ("first", "after"):
+            pos += 1
+            break
+        elif state == "after":
+            if char != ",":
+                raise MalformedBody("expected ',' or ']' after an item")
+            pos, state = pos + 1, "item"
+        else:
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+                # a value ending exactly at the end of the buffer (e.g. a number) may continue in the next chunk
+                complete = end < len(buffer) or eof
+            except ValueError:
+                item, complete = None, False
+                if eof:
+                    raise MalformedBody("invalid JSON in an item")
+            if not complete:
+                if len(buffer) - pos > MAX_ITEM_BYTES:
+                    raise MalformedBody("item is malformed or too large")
+                buffer, pos = buffer[pos:], 0
+                try:
+                    buffer += await texts.__anext__()
+                except StopAsyncIteration:
+                    eof = True
+                continue
+            yield item, None
+            pos, state = end, "after"
+    if buffer[pos:].strip():
+        raise MalformedBody("unexpected data after the array")
+    async for text in texts:
+        if text.strip():
+            raise MalformedBody("unexpected data after the array")
@@ -0,0 +1,87 @@
+import logging
+import time
+from contextvars import ContextVar
+from fastapi import Request
+from sqlalchemy import event
+from sqlalchemy.engine import default
+from . import metrics
+from .config import settings
+
+# Per-request instrumentation: latency per route template, plus the number of SQL
+# statements and the time spent in them, collected by cursor hooks on the engines.
+# Requests slower than slow_request_seconds are logged with the statements they ran.
+
+logger = logging.getLogger(__name__)
+
+request_seconds = metrics.Histogram("http_request_duration_seconds", "Request latency by method, route template and status")
+request_queries = metrics.Histogram("http_request_db_queries", "SQL statements executed per request", buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100))
+request_db_seconds = metrics.Histogram("http_request_db_seconds", "Time spent executing SQL per request")
+
+statement_cache = metrics.Counter("sqlalchemy_compiled_cache_total", "Statements executed by whether their compiled SQL came from SQLAlchemy's cache")
+
+CACHE_RESULTS = {
+    default.CACHE_HIT: "hit",
+    default.CACHE_MISS: "miss",
+    default.CACHING_DISABLED: "disabled",
+    default.NO_CACHE_KEY: "no_key",
+    default.NO_DIALECT_SUPPORT: "no_dialect_support",
+}
+
+# statements kept per request for the slow-request log
+MAX_LOGGED_STATEMENTS = 50
+
+class RequestStats:
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.statements = []
+
+current_request = ContextVar("current_request", default=None)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # kept on the execution context, so a failed statement leaves nothing behind
+    context._query_start = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._query_start
+    statement_cache.inc(result=CACHE_RESULTS.get(context.cache_hit, "other"))
+    # SQLAlchemy runs these hooks inside the request's context, even for the async engine
+    stats = current_request.get()
+    if stats is None:
+        return
+    stats.queries += 1
+    stats.db_seconds += elapsed
+    if len(stats.statements) < MAX_LOGGED_STATEMENTS:
+        stats.statements.append((elapsed, statement))
+
+def statement_cache_stats():
+    counts = {dict(labels)["result"]: int(value) for labels, value in statement_cache.snapshot().items()}
+    cacheable = counts.get("hit", 0) + counts.get("miss", 0)
+    return {**counts, "hit_ratio": counts.get("hit", 0) / cacheable if cacheable else None}
+
+def instrument_engine(engine):
+    # engine: a sync Engine, or the sync_engine of an AsyncEngine
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+async def instrument_requests(request: Request, call_next):
+    stats = RequestStats()
+    token = current_request.set(stats)
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        elapsed = time.perf_counter() - start
+        current_request.reset(token)
+        # the matched route's template, e.g. /posts/{id}, keeps the label set small
+        route = request.scope.get("route")
+        path = route.path if route is not None else "unmatched"
+        request_seconds.observe(elapsed, method=request.method, route=path, status=status_code)
+        request_queries.observe(stats.queries, method=request.method, route=path)
+        request_db_seconds.observe(stats.db_seconds, method=request.method, route=path)
+        if elapsed >= settings.slow_request_seconds:
+            statements = "".join(f"\n  {seconds * 1000:.1f} ms  {' '.join(statement.split())}" for seconds, statement in stats.statements)
+            logger.warning("slow request: %s %s %d took %.3f s, %d queries in %.3f s%s", request.method, path, status_code, elapsed, stats.queries, stats.db_seconds, statements)
@@ -0,0 +1,146 @@
+import asyncio
+import json
+import logging
+import uuid
+import asyncpg
+from sqlalchemy import select, func, bindparam, String, Select
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import metrics, oauth2
+from .cache import response_cache
+from .config import settings
+from .database import SQLALCHEMY_DATABASE_URL
+
+# Cross-worker cache invalidation over Postgres LISTEN/NOTIFY. Write paths publish the cache tags
+# they touch ("feed", "post:12", "user:3") inside their transaction, so Postgres delivers them
+# when it commits and never when it rolls back. Every worker listens on its own connection and
+# evicts the tagged entries from its in-process caches: the memory response cache and the
+# principal cache. The writing worker evicts its own entries directly and skips its own messages.
+# A listener that loses its connection may have missed messages, so it clears those caches when
+# it reconnects.
+#
+# Hot writes (votes, post edits) don't spend a round-trip on it: notifying() adds the NOTIFY to
+# the write statement itself as one more CTE, fed by the `invalidations` parameter built with
+# payloads(). Rarer batched writes call publish(), which sends it as a statement of its own.
+
+CHANNEL = "cache_invalidation"
+# NOTIFY payloads are limited to 8000 bytes
+TAGS_PER_MESSAGE = 100
+# how often an idle listener checks that its connection is still alive
+PING_SECONDS = 10
+
+WORKER_ID = uuid.uuid4().hex
+
+logger = logging.getLogger(__name__)
+
+messages = metrics.Counter("cache_invalidation_messages_total", "Invalidation messages published and received by this worker")
+
+_payloads = func.unnest(bindparam("invalidations", type_=ARRAY(String))).table_valued("payload").render_derived()
+# pg_notify is volatile, so Postgres runs this CTE once rather than inlining it, but only if the
+# statement reads it: notifying() adds a column counting its rows
+NOTIFIED = select(func.pg_notify(CHANNEL, _payloads.c.payload)).cte("notified")
+NOTIFY = select(func.count()).select_from(NOTIFIED)
+
+def payloads(*tags):
+    # the `invalidations` parameter announcing these tags; empty when no other worker needs them
+    if not settings.cache_invalidation_enabled:
+        return []
+    # other workers hold feed and post entries only in a memory response cache, a redis one was
+    # invalidated by the writer; principals are always cached in-process
+    local = settings.response_cache_backend == "memory"
+    tags = [tag for tag in dict.fromkeys(tags) if local or tag.startswith("user:")]
+    invalidations = [json.dumps({"origin": WORKER_ID, "tags": tags[start:start + TAGS_PER_MESSAGE]}) for start in range(0, len(tags), TAGS_PER_MESSAGE)]
+    messages.inc(len(invalidations), direction="sent")
+    return invalidations
+
+def notifying(stmt):
+    # stmt with the NOTIFY of its `invalidations` parameter folded in. It is sent when the statement
+    # returns rows, i.e. when the write changed something.
+    sent = select(func.count()).select_from(NOTIFIED).scalar_subquery().label("notified")
+    stmt = stmt.add_cte(NOTIFIED)
+    return stmt.add_columns(sent) if isinstance(stmt, Select) else stmt.returning(sent)
+
+async def publish(db: AsyncSession, *tags):
+    # call before db.commit(); evicting this worker's own entries after the commit stays the caller's job
+    invalidations = payloads(*tags)
+    if invalidations:
+        await db.execute(NOTIFY, {"invalidations": invalidations})
+
+async def evict(tags):
+    # a shared (redis) response cache was already invalidated by the writer
+    if not response_cache.backend.shared:
+        await response_cache.invalidate(*tags)
+    for tag in tags:
+        if tag.startswith("user:"):
+            oauth2.invalidate_principal(int(tag[len("user:"):]))
+
+async def evict_all():
+    if not response_cache.backend.shared:
+        await response_cache.clear()
+    oauth2.principal_cache.clear()
+
+class InvalidationListener:
+    def __init__(self, url: str):
+        self.url = url
+        self.connected = False
+        self._task = None
+        self._evictions = set()
+
+    def _on_message(self, connection, pid, channel, payload):
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            return
+        if message.get("origin") == WORKER_ID:
+            return
+        messages.inc(direction="received")
+        # evictions are coroutines; keep a reference until they are done
+        task = asyncio.get_running_loop().create_task(evict(message.get("tags", [])))
+        self._evictions.add(task)
+        task.add_done_callback(self._evictions.discard)
+
+    async def _listen(self, reconnect: bool):
+        connection = await asyncpg.connect(self.url)
+        try:
+            lost = asyncio.Event()
+            connection.add_termination_listener(lambda connection: lost.set())
+            await connection.add_listener(CHANNEL, self._on_message)
+            if reconnect:
+                # whatever was published while we weren't listening is lost; cleared only now,
+                # so nothing published from here on can be missed
+                await evict_all()
+            self.connected = True
+            while not lost.is_set():
+                try:
+                    await asyncio.wait_for(lost.wait(), PING_SECONDS)
+                except asyncio.TimeoutError:
+                    await asyncio.wait_for(connection.execute("SELECT 1"), PING_SECONDS)
+        finally:
+            self.connected = False
+            if not connection.is_closed():
+                connection.terminate()
+
+    async def _run(self):
+        reconnect = False
+        while True:
+            try:
+                await self._listen(reconnect)
+                logger.warning("cache invalidation listener lost its connection, reconnecting")
+            except Exception:
+                logger.warning("cache invalidation listener lost its connection, reconnecting", exc_info=True)
+            reconnect = True
+            await asyncio.sleep(1)
+
+    def start(self):
+        if settings.cache_invalidation_enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+listener = InvalidationListener(settings.cache_invalidation_listen_url or SQLALCHEMY_DATABASE_URL)
+
+metrics.Gauge("cache_invalidation_listener_connected", "Whether this worker is listening for invalidations", lambda: {(): int(listener.connected)})
@@ -1,20 +1,62 @@
-from fastapi import FastAPI
-from .routers import post, user, auth, vote
+import math
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from .routers import post, user, auth, vote, follow, timeline, metrics
+from .config import settings
+from .database import async_engine, replicas, is_write
+from .utils import start_password_pool, shutdown_password_pool
+from .instrumentation import instrument_requests
+from .admission import admission_control
+from .vote_buffer import vote_buffer
+from .invalidation import listener
 from fastapi.middleware.cors import CORSMiddleware
 
-socialMediaApp = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    replicas.start()
+    listener.start()
+    await start_password_pool()
+    if settings.vote_buffer_enabled:
+        vote_buffer.start()
+    yield
+    # before the engine goes away: acknowledged votes still in the buffer get stored
+    await vote_buffer.stop()
+    shutdown_password_pool()
+    await listener.stop()
+    await replicas.stop()
+    await async_engine.dispose()
+
+socialMediaApp = FastAPI(lifespan=lifespan)
 
 # using Almebic now instead
 # models.Base.metadata.create_all(bind=engine)
 
 origins = ["*"]
 
+@socialMediaApp.middleware("http")
+async def remember_writes(request: Request, call_next):
+    # tells get_read_db to send this client's reads to the primary for a little while,
+    # so it sees its own write before the replicas have replayed it
+    response = await call_next(request)
+    if replicas.engines and is_write(request) and response.status_code < 400:
+        last_write = f"{time.time():.3f}"
+        response.headers["X-Last-Write"] = last_write
+        response.set_cookie("last_write", last_write, max_age=math.ceil(settings.read_your_writes_seconds), httponly=True, samesite="lax")
+    return response
+
+socialMediaApp.middleware("http")(admission_control)
+# added after the others so it wraps them and times them too, shed requests included
+socialMediaApp.middleware("http")(instrument_requests)
+# outermost, so every response carries the CORS headers, 503s of shed requests included;
+# otherwise a browser can't read them and sees a network error instead
 socialMediaApp.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Last-Write", "ETag", "Retry-After"],
 )
 
 
@@ -23,4 +65,6 @@ socialMediaApp.include_router(post.router)
 socialMediaApp.include_router(user.router)
 socialMediaApp.include_router(auth.router)
 socialMediaApp.include_router(vote.router)
-
+socialMediaApp.include_router(follow.router)
+socialMediaApp.include_router(timeline.router)
+socialMediaApp.include_router(metrics.router)
@@ -0,0 +1,95 @@
+import threading
+from collections import defaultdict
+
+# Minimal in-process metrics. Every metric registers itself in REGISTRY so the
+# metrics router can report all of them; label values are passed as keyword args.
+
+REGISTRY = []
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def _key(labels):
+    return tuple(sorted(labels.items()))
+
+class Counter:
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self._values = defaultdict(float)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, amount: float = 1, **labels):
+        with self._lock:
+            self._values[_key(labels)] += amount
+
+    def value(self, **labels):
+        return self._values.get(_key(labels), 0)
+
+    def snapshot(self):
+        with self._lock:
+            return {key: value for key, value in self._values.items()}
+
+class Histogram:
+    def __init__(self, name: str, description: str, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts, sum, count, max]
+        self._series = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value: float, **labels):
+        with self._lock:
+            series = self._series.get(_key(labels))
+            if series is None:
+                series = self._series[_key(labels)] = [[0] * len(self.buckets), 0.0, 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+            series[3] = max(series[3], value)
+
+    def snapshot(self):
+        with self._lock:
+            return {key: {"buckets": list(counts), "sum": total, "count": count, "max": maximum} for key, (counts, total, count, maximum) in self._series.items()}
+
+class Gauge:
+    # value read at scrape time from `collect`, which returns {labels tuple: value}
+    def __init__(self, name: str, description: str, collect):
+        self.name = name
+        self.description = description
+        self.collect = collect
+        REGISTRY.append(self)
+
+    def snapshot(self):
+        return self.collect()
+
+def _labels(key, **extra):
+    pairs = [*key, *extra.items()]
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+def render_prometheus():
+    # Prometheus text exposition format, version 0.0.4
+    lines = []
+    for metric in REGISTRY:
+        kind = "counter" if isinstance(metric, Counter) else "histogram" if isinstance(metric, Histogram) else "gauge"
+        lines += [f"# HELP {metric.name} {metric.description}", f"# TYPE {metric.name} {kind}"]
+        for key, value in sorted(metric.snapshot().items()):
+            if kind != "histogram":
+                lines.append(f"{metric.name}{_labels(key)} {value}")
+                continue
+            # bucket counts are already cumulative: observe() counts a value in every bucket it fits
+            for bound, count in zip(metric.buckets, value["buckets"]):
+                lines.append(f"{metric.name}_bucket{_labels(key, le=bound)} {count}")
+            lines.append(f"{metric.name}_bucket{_labels(key, le='+Inf')} {value['count']}")
+            lines.append(f"{metric.name}_sum{_labels(key)} {value['sum']}")
+            lines.append(f"{metric.name}_count{_labels(key)} {value['count']}")
+    return "\n".join(lines) + "\n"
+
+pool_wait_seconds = Histogram("db_pool_wait_seconds", "Time spent waiting to check a connection out of the database pool")
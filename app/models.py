@@ -1,7 +1,8 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, String, Boolean, Float, ForeignKey, Index, Computed
 from sqlalchemy.sql.expression import text
 from sqlalchemy.sql.sqltypes import TIMESTAMP
-from sqlalchemy.orm import Relationship
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import Relationship, deferred, synonym
 
 from .database import Base
 
@@ -13,9 +14,27 @@ class Post(Base):
     content = Column(String, nullable=False)
     published = Column(Boolean, server_default='TRUE' ,nullable=False)
     created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text('now()'))
+    # version for conditional GETs, set by edits and vote changes
+    updated_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text('now()'))
     owner_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    votes_count = Column(Integer, server_default='0', nullable=False)
+    # kept in step by the vote endpoints and decayed by `python -m app.commands decay-hot-scores`
+    hot_score = Column(Float, server_default='0', nullable=False)
+    search_vector = deferred(Column(TSVECTOR, Computed("to_tsvector('english', title || ' ' || content)", persisted=True)))
+    votes = synonym("votes_count")
     owner = Relationship("User")
     
+    __table_args__ = (
+        Index("ix_posts_created_at_id", "created_at", "id"),
+        # newest posts of one author, for timelines read with fan-out-on-read
+        Index("ix_posts_owner_id_created_at_id", "owner_id", "created_at", "id"),
+        Index("ix_posts_hot_score_id", "hot_score", "id"),
+        Index("ix_posts_votes_count_id", "votes_count", "id"),
+        Index("ix_posts_search_vector", "search_vector", postgresql_using="gin"),
+        Index("ix_posts_title_trgm", "title", postgresql_using="gin", postgresql_ops={"title": "gin_trgm_ops"}),
+        Index("ix_posts_content_trgm", "content", postgresql_using="gin", postgresql_ops={"content": "gin_trgm_ops"}),
+    )
+    
 class User(Base):
     __tablename__ = "users"
     
@@ -23,10 +42,42 @@ class User(Base):
     email = Column(String, nullable=False, unique=True)
     password = Column(String, nullable=False)
     created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text('now()'))
+    followers_count = Column(Integer, server_default='0', nullable=False)
     
 class Vote(Base):
     __tablename__ = "votes"
     
     user_id = Column(ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
     post_id = Column(ForeignKey("posts.id", ondelete="CASCADE"), primary_key=True)
-    vote_dir = Column(Integer, nullable=False)
\ No newline at end of file
+    vote_dir = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        # the primary key leads with user_id; per-post counts and the cascade from posts need this
+        Index("ix_votes_post_id", "post_id"),
+    )
+
+class Follow(Base):
+    __tablename__ = "follows"
+    
+    follower_id = Column(ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    followee_id = Column(ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text('now()'))
+    
+    __table_args__ = (
+        Index("ix_follows_followee_id", "followee_id"),
+    )
+    
+class TimelineEntry(Base):
+    # a post in a follower's home timeline, written when the post is created (fan-out-on-write)
+    __tablename__ = "timeline_entries"
+    
+    user_id = Column(ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    post_id = Column(ForeignKey("posts.id", ondelete="CASCADE"), primary_key=True)
+    # copy of posts.created_at so a timeline page never has to touch posts to seek
+    created_at = Column(TIMESTAMP(timezone=True), nullable=False)
+    
+    __table_args__ = (
+        Index("ix_timeline_entries_user_id_created_at_post_id", "user_id", "created_at", "post_id"),
+        # deleting a post cascades here
+        Index("ix_timeline_entries_post_id", "post_id"),
+    )
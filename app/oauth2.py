@@ -1,11 +1,15 @@
+import logging
 import jwt
 from jwt.exceptions import InvalidTokenError
 from datetime import datetime, timedelta, timezone
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import select, lambda_stmt
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
 from .database import get_db
 from . import schemas, models
+from .cache import TTLCache
 from .config import settings
 
 SECRET_KEY = settings.secret_key
@@ -14,8 +18,13 @@ ACCESS_TOKEN_EXPIRE_MINUTES = settings.access_token_expire_minutes
 
 oauth2_schema = OAuth2PasswordBearer(tokenUrl="login")
 
+logger = logging.getLogger(__name__)
+
+# (user_id, token) -> detached models.User, so authenticated requests skip the users lookup
+principal_cache = TTLCache(maxsize=settings.principal_cache_size, ttl=settings.principal_cache_ttl_seconds)
+
 def create_access_token(data: dict):
-    print(ACCESS_TOKEN_EXPIRE_MINUTES)
+    logger.debug("issuing an access token valid for %d minutes", ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode = data.copy()
     
     expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -25,19 +34,41 @@ def create_access_token(data: dict):
     
     return enocded_jwt
 
+def user_claims(user: models.User):
+    claims = {"user_id": user.id}
+    if settings.auth_trust_token_claims:
+        # everything get_current_user needs travels in the signed token
+        claims.update(email=user.email, created_at=user.created_at.isoformat())
+    return claims
+
 def verify_access_token(token: str, credentials_exception):
     try:
         payload = jwt.decode(jwt= token, key= SECRET_KEY, algorithms=[ALGORITHM])
         userId = payload.get("user_id")
         if userId is None:
             raise credentials_exception
-        TokenData = schemas.TokenData(id= userId)
+        TokenData = schemas.TokenData(id= userId, email= payload.get("email"), created_at= payload.get("created_at"))
     except InvalidTokenError:
         raise credentials_exception
     return TokenData
 
-def get_current_user(token: str = Depends(oauth2_schema), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_schema), db: AsyncSession = Depends(get_db)):
     credentials_exception = HTTPException(status_code= status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials", headers={"WWW-Authenticate": "Bearer"})
-    user_id = verify_access_token(token= token, credentials_exception= credentials_exception).id
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    return user
\ No newline at end of file
+    token_data = verify_access_token(token= token, credentials_exception= credentials_exception)
+    if settings.auth_trust_token_claims and token_data.email and token_data.created_at:
+        user = models.User(id=token_data.id, email=token_data.email, created_at=token_data.created_at)
+        make_transient_to_detached(user)
+        return user
+    user = principal_cache.get((token_data.id, token))
+    if user is None:
+        user_id = token_data.id
+        user = await db.scalar(lambda_stmt(lambda: select(models.User).where(models.User.id == user_id)))
+        if user is None:
+            raise credentials_exception
+        db.expunge(user)
+        principal_cache.set((token_data.id, token), user)
+    return user
+
+def invalidate_principal(user_id: int):
+    # call whenever a user row changes; tokens carrying trusted claims stay valid until they expire
+    principal_cache.pop_where(lambda key: key[0] == user_id)
\ No newline at end of file
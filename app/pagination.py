@@ -0,0 +1,23 @@
+import base64
+import json
+from datetime import datetime
+from fastapi import HTTPException, status
+
+# Cursors are opaque to clients: a url-safe base64 of the sort key of the last row
+# they received, e.g. (created_at, id) for the default newest-first feed.
+
+# largest page a client may ask for; also bounds the size of cached feed pages
+MAX_PAGE_SIZE = 100
+
+def encode_cursor(*values):
+    raw = json.dumps([value.isoformat() if isinstance(value, datetime) else value for value in values], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str, *types):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if len(values) != len(types):
+            raise ValueError(cursor)
+        return tuple(datetime.fromisoformat(value) if type_ is datetime else type_(value) for type_, value in zip(types, values))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="invalid cursor")
@@ -1,6 +1,7 @@
 from fastapi import FastAPI, HTTPException, status, Response, Depends, APIRouter
 from fastapi.security.oauth2 import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
 from .. import models, utils, oauth2, schemas
 from ..database import get_db
 
@@ -9,13 +10,20 @@ router = APIRouter(
 )
 
 @router.post("/login", response_model=schemas.Token)
-def login(userCredentials: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.email == userCredentials.username).first()
+async def login(userCredentials: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
+    user = await db.scalar(select(models.User).where(models.User.email == userCredentials.username))
     if not user:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="invalid creds")
-    if not utils.verify_password(userCredentials.password, user.password):
+    # end the read transaction so the connection goes back to the pool while bcrypt runs
+    await db.commit()
+    valid, new_hash = await utils.async_verify_password(userCredentials.password, user.password)
+    if not valid:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="invalid creds")
+    if new_hash:
+        # the bcrypt cost settings changed since this hash was made
+        user.password = new_hash
+        await db.commit()
     
-    access_token = oauth2.create_access_token(data={"user_id": user.id})
+    access_token = oauth2.create_access_token(data=oauth2.user_claims(user))
     
     return {"access_token": access_token, "token_type": "bearer"}
\ No newline at end of file
@@ -0,0 +1,33 @@
+from fastapi import APIRouter, HTTPException, status, Response, Depends
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import schemas, oauth2, timeline, invalidation
+from ..database import get_db
+router = APIRouter(
+    prefix = "/follows",
+    tags = ["Follows"])
+
+@router.post("/", status_code=status.HTTP_201_CREATED, response_model=schemas.FollowReturn)
+async def follow_user(follow: schemas.Follow, current_user: int = Depends(oauth2.get_current_user), db: AsyncSession = Depends(get_db)):
+    if follow.user_id == current_user.id:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Users can't follow themselves")
+    try:
+        followed = await timeline.follow(db, current_user.id, follow.user_id)
+    except IntegrityError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"User with ID {follow.user_id} doesn't exist")
+    if not followed:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"User {current_user.id} already follows user {follow.user_id}")
+    # followers_count of the followed user changed; principals cached by other workers are stale
+    await invalidation.publish(db, f"user:{follow.user_id}")
+    await db.commit()
+    oauth2.invalidate_principal(follow.user_id)
+    return {"follower_id": current_user.id, "followee_id": follow.user_id}
+
+@router.delete("/", status_code=status.HTTP_204_NO_CONTENT)
+async def unfollow_user(follow: schemas.Follow, current_user: int = Depends(oauth2.get_current_user), db: AsyncSession = Depends(get_db)):
+    if not await timeline.unfollow(db, current_user.id, follow.user_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"User {current_user.id} doesn't follow user {follow.user_id}")
+    await invalidation.publish(db, f"user:{follow.user_id}")
+    await db.commit()
+    oauth2.invalidate_principal(follow.user_id)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
@@ -0,0 +1,29 @@
+from fastapi import APIRouter, Response
+from ..cache import cache_stats
+from ..metrics import render_prometheus
+from ..instrumentation import statement_cache_stats
+from ..database import pool_stats
+
+router = APIRouter(
+    prefix = "/metrics",
+    tags = ["Metrics"]
+)
+
+@router.get("")
+async def get_prometheus_metrics():
+    # every registered metric, for Prometheus to scrape
+    return Response(content=render_prometheus(), media_type="text/plain; version=0.0.4")
+
+@router.get("/pool")
+async def get_pool_metrics():
+    return pool_stats()
+
+
+@router.get("/cache")
+async def get_cache_metrics():
+    return cache_stats()
+
+
+@router.get("/statements")
+async def get_statement_metrics():
+    return statement_cache_stats()
@@ -1,80 +1,334 @@
-from fastapi import FastAPI, HTTPException, status, Response, Depends, APIRouter
-from typing import List, Optional
-from fastapi.encoders import jsonable_encoder
-from sqlalchemy.orm import Session
-from sqlalchemy import func
-from .. import models, schemas, oauth2
-from ..database import get_db
+import functools
+import zlib
+from fastapi import FastAPI, HTTPException, status, Response, Depends, APIRouter, Request, Query
+from fastapi.responses import StreamingResponse
+from typing import List, Optional, Literal
+from datetime import datetime
+from pydantic import TypeAdapter, ValidationError, create_model
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy import select, insert, update, delete, func, tuple_, cast, or_, any_, bindparam, lambda_stmt, Float, Integer, String, literal_column
+from sqlalchemy.dialects.postgresql import ARRAY
+from .. import models, schemas, oauth2, pagination, ingest, timeline, admission, conditional, invalidation
+from ..cache import response_cache
+from ..config import settings
+from ..database import get_db, get_read_db, read_session
 
 router = APIRouter(
     prefix = "/posts",
     tags=["Posts"]
 )
 
+# must match the text search configuration of the generated posts.search_vector column
+SEARCH_CONFIG = literal_column("'english'::regconfig")
 
-@router.post("/", status_code=status.HTTP_201_CREATED, response_model=schemas.PostReturn)
-def create_post(post: schemas.PostCreate, db: Session = Depends(get_db), current_user: int = Depends(oauth2.get_current_user)):
-    newPost = models.Post(**post.model_dump(), owner_id= current_user.id)
-    db.add(newPost)
-    db.commit()
-    db.refresh(newPost)
+PostList = TypeAdapter(List[schemas.PostReturnWithVotes])
+
+# fields=... of GET /posts -> the column serving each field, in response order. owner.id is
+# read from posts.owner_id, so only owner.email and owner.created_at need the users join.
+POST_FIELDS = {
+    "title": models.Post.title,
+    "content": models.Post.content,
+    "published": models.Post.published,
+    "id": models.Post.id,
+    "created_at": models.Post.created_at,
+    "owner_id": models.Post.owner_id,
+    "owner.email": models.User.email,
+    "owner.id": models.Post.owner_id,
+    "owner.created_at": models.User.created_at,
+    "votes": models.Post.votes_count,
+}
+
+def parse_fields(fields: str):
+    # "id,title,owner.email" -> ("title", "id", "owner.email"); "owner" stands for all owner fields
+    requested = {name.strip() for name in fields.split(",") if name.strip()}
+    requested |= {name for name in POST_FIELDS if name.startswith("owner.")} if "owner" in requested else set()
+    requested.discard("owner")
+    unknown = requested - POST_FIELDS.keys()
+    if unknown or not requested:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"fields must name some of: {', '.join(POST_FIELDS)}")
+    return tuple(name for name in POST_FIELDS if name in requested)
+
+@functools.lru_cache(maxsize=None)
+def fields_list(fields: tuple):
+    # a list of slimmed down PostReturnWithVotes, with just the requested fields
+    post_fields = schemas.PostReturnWithVotes.model_fields
+    owner_fields = {name[len("owner."):]: (schemas.UserOut.model_fields[name[len("owner."):]].annotation, ...) for name in fields if name.startswith("owner.")}
+    attributes = {name: (post_fields[name].annotation, ...) for name in fields if "." not in name}
+    if owner_fields:
+        attributes["owner"] = (create_model("PostOwnerFields", **owner_fields), ...)
+    return TypeAdapter(List[create_model("PostFields", **attributes)])
+
+# rows fetched per round-trip from the server-side cursor of GET /posts/export
+EXPORT_BATCH_SIZE = 1000
+
+# sort=... of GET /posts -> (sort key, cursor value types); each key has a matching
+# (column, id) index so a page is a backward range scan. Search results default to relevance.
+SORT_KEYS = {
+    "new": ((models.Post.created_at, models.Post.id), (datetime, int)),
+    "hot": ((models.Post.hot_score, models.Post.id), (float, int)),
+    "top": ((models.Post.votes_count, models.Post.id), (int, int)),
+}
+
+@functools.lru_cache(maxsize=None)
+def feed_statement(order: str, search_mode: Optional[str], seek: bool, versions: bool = False, fields: tuple = None):
+    # GET /posts query for one combination of options. Built once and executed with the request's
+    # values as parameters, so it skips statement construction and reuses the compiled SQL.
+    # Rows are (post, *sort key). With versions they are (updated_at, *sort key), for revalidation;
+    # with fields, (*requested columns, updated_at, *sort key), for a sparse fieldset.
+    if versions:
+        query = select(models.Post.updated_at)
+    elif fields:
+        query = select(*(POST_FIELDS[name] for name in fields), models.Post.updated_at)
+        if any(POST_FIELDS[name].class_ is models.User for name in fields):
+            query = query.join(models.Post.owner)
+    else:
+        query = select(models.Post).options(joinedload(models.Post.owner))
+    if search_mode == "fulltext":
+        # served by the GIN index on the generated posts.search_vector column
+        ts_query = func.websearch_to_tsquery(SEARCH_CONFIG, bindparam("search", type_=String))
+        query = query.where(models.Post.search_vector.op("@@")(ts_query))
+    elif search_mode == "substring":
+        # served by the pg_trgm GIN indexes on title and content
+        pattern = bindparam("pattern", type_=String)
+        query = query.where(or_(models.Post.title.ilike(pattern, escape="\\"), models.Post.content.ilike(pattern, escape="\\")))
+    # the columns the page is ordered by (descending); the cursor carries their values for the last row
+    if order == "relevance":
+        sort_key = (cast(func.ts_rank(models.Post.search_vector, ts_query), Float), models.Post.id)
+    else:
+        sort_key = SORT_KEYS[order][0]
+    query = query.add_columns(*sort_key).order_by(*(column.desc() for column in sort_key))
+    if seek:
+        # keyset pagination: seek past the last row of the previous page, e.g. via ix_posts_created_at_id
+        query = query.where(tuple_(*sort_key) < tuple_(*(bindparam(f"after_{i}", type_=column.type) for i, column in enumerate(sort_key))))
+    else:
+        query = query.offset(bindparam("skip", type_=Integer))
+    # callers fetch one extra row to know whether there is a next page
+    return query.limit(bindparam("limit", type_=Integer))
+
+# POST /posts/lookup: every requested post and its owner in one round-trip, served by the primary key
+LOOKUP_POSTS = select(models.Post).options(joinedload(models.Post.owner)).where(models.Post.id == any_(bindparam("ids", type_=ARRAY(Integer))))
+
+CREATE_POST = invalidation.notifying(insert(models.Post).values(
+    title=bindparam("title"), content=bindparam("content"), published=bindparam("published"), owner_id=bindparam("owner_id"),
+).returning(models.Post))
+
+UPDATE_POST = invalidation.notifying(update(models.Post).where(models.Post.id == bindparam("post_id")).values(
+    title=bindparam("title"), content=bindparam("content"), published=bindparam("published"), updated_at=func.now(),
+).returning(models.Post)).execution_options(synchronize_session=False, populate_existing=True)
+
+# valid items of POST /posts/bulk are inserted and committed this many at a time
+BULK_CHUNK_SIZE = 1000
+
+
+@router.post("/", status_code=status.HTTP_201_CREATED, response_model=schemas.PostReturn, dependencies=[Depends(admission.limit_posts)])
+async def create_post(post: schemas.PostCreate, db: AsyncSession = Depends(get_db), current_user: int = Depends(oauth2.get_current_user)):
+    # the INSERT returns the server defaults along with the row and announces the new post to the other workers
+    newPost = await db.scalar(CREATE_POST, {**post.model_dump(), "owner_id": current_user.id, "invalidations": invalidation.payloads("feed")})
+    await timeline.fan_out(db, [newPost.id])
+    await db.commit()
+    # current_user is a detached, already loaded user; attaching it as the owner costs no query
+    set_committed_value(newPost, "owner", current_user)
+    await response_cache.invalidate("feed")
     return newPost
 
+@router.post("/bulk", response_model=schemas.BulkPostReturn, dependencies=[Depends(admission.limit_bulk_posts)])
+async def create_posts_bulk(request: Request, db: AsyncSession = Depends(get_db), current_user: int = Depends(oauth2.get_current_user)):
+    # body is a JSON array or, with Content-Type application/x-ndjson, one post per line
+    if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+        items = ingest.iter_ndjson(request.stream())
+    else:
+        items = ingest.iter_json_array(request.stream())
+    ids, errors, chunk = [], [], []
+
+    async def flush():
+        # one multi-row INSERT .. RETURNING per page of insertmanyvalues; ids come back in row order
+        stmt = insert(models.Post).returning(models.Post.id, sort_by_parameter_order=True)
+        created = (await db.scalars(stmt, [row for _, row in chunk])).all()
+        await timeline.fan_out(db, created)
+        await invalidation.publish(db, "feed")
+        await db.commit()
+        for (index, _), post_id in zip(chunk, created):
+            ids[index] = post_id
+        chunk.clear()
+
+    try:
+        async for item, error in items:
+            index = len(ids)
+            ids.append(None)
+            if error is not None:
+                errors.append(schemas.BulkPostError(index=index, errors=[{"type": "json_invalid", "msg": error}]))
+                continue
+            try:
+                post = schemas.PostCreate.model_validate(item)
+            except ValidationError as invalid:
+                errors.append(schemas.BulkPostError(index=index, errors=invalid.errors(include_url=False, include_context=False)))
+                continue
+            chunk.append((index, {**post.model_dump(), "owner_id": current_user.id}))
+            if len(chunk) >= BULK_CHUNK_SIZE:
+                await flush()
+    except ingest.MalformedBody as malformed:
+        # the rest of the body can't be split into items; what was parsed so far is still written
+        errors.append(schemas.BulkPostError(index=len(ids), errors=[{"type": "json_invalid", "msg": str(malformed)}]))
+    if chunk:
+        await flush()
+    if any(post_id is not None for post_id in ids):
+        await response_cache.invalidate("feed")
+    return schemas.BulkPostReturn(ids=ids, errors=errors)
+
 @router.get("/", response_model=List[schemas.PostReturnWithVotes])
-def get_posts(db: Session = Depends(get_db), limit: int = 10, skip: int = 0, search: Optional[str] = "", response_model=List[schemas.PostReturnWithVotes]):
-    results = db.query(models.Post, func.count(models.Vote.post_id).label("votes")).join(models.Vote, models.Post.id == models.Vote.post_id, isouter=True).group_by(models.Post.id).filter(models.Post.title.contains(search)).limit(limit).offset(skip).all()
+async def get_posts(request: Request, db: AsyncSession = Depends(get_read_db), limit: int = Query(10, ge=1, le=pagination.MAX_PAGE_SIZE), skip: int = Query(0, ge=0), search: Optional[str] = "", search_mode: Literal["fulltext", "substring"] = "fulltext", sort: Optional[Literal["new", "hot", "top"]] = None, cursor: Optional[str] = None, fields: Optional[str] = None):
+    # fields=title,votes,owner.email selects only those columns and returns only those fields
+    fields = parse_fields(fields) if fields else None
+    # the first few pages are the hot ones; deeper pages and cursors are not worth caching
+    cacheable = cursor is None and skip < limit * settings.response_cache_feed_pages
+    if cacheable:
+        cache_key = response_cache.key("/posts/", limit=limit, skip=skip, search=search, search_mode=search_mode, sort=sort or "", fields=",".join(fields or ()))
+    # inside its read-your-writes window a client must not be served a page cached before its write
+    if cacheable and not db.info["read_your_writes"]:
+        cached = await response_cache.get("/posts/", cache_key)
+        if cached is not None:
+            return conditional.not_modified(cached.headers) if conditional.is_fresh(request, cached.headers) else cached
+    # relevance only exists for full-text searches, which default to it
+    order = sort or ("relevance" if search and search_mode == "fulltext" else "new")
+    params = {"limit": limit + 1}
+    if search and search_mode == "fulltext":
+        params["search"] = search
+    elif search:
+        params["pattern"] = "%" + search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    if cursor:
+        cursor_types = (float, int) if order == "relevance" else SORT_KEYS[order][1]
+        params.update((f"after_{i}", value) for i, value in enumerate(pagination.decode_cursor(cursor, *cursor_types)))
+    else:
+        params["skip"] = skip
+
+    def page(results):
+        # every sort key is (column, id) and ends the row, whichever columns come first
+        headers = {}
+        if len(results) > limit:
+            results = results[:limit]
+            headers["X-Next-Cursor"] = pagination.encode_cursor(*results[-1][-2:])
+        return results, headers
+
+    # a sparse page is its own representation, with its own ETag
+    variant = ",".join(fields or ())
+    if "if-none-match" in request.headers:
+        # revalidation reads only the page's versions: no owner join and no serialization
+        versions, headers = page((await db.execute(feed_statement(order, search_mode if search else None, bool(cursor), True), params)).all())
+        headers.update(conditional.page_headers(((row[-1], row[0]) for row in versions), variant))
+        if conditional.is_fresh(request, headers):
+            return conditional.not_modified(headers)
+    results, headers = page((await db.execute(feed_statement(order, search_mode if search else None, bool(cursor), False, fields), params)).all())
+
+    if fields:
+        # rows are (*fields, updated_at, column, id); owner.* values nest under owner
+        items, versions = [], [(row[-1], row[-3]) for row in results]
+        for row in results:
+            item = {}
+            for name, value in zip(fields, row):
+                if name.startswith("owner."):
+                    item.setdefault("owner", {})[name[len("owner."):]] = value
+                else:
+                    item[name] = value
+            items.append(item)
+        adapter = fields_list(fields)
+        body = adapter.dump_json(adapter.validate_python(items))
+    else:
+        # owners are joined in the same query, so the rows serialize straight into the response schema
+        posts = [post for post, *_ in results]
+        versions = [(post.id, post.updated_at) for post in posts]
+        body = PostList.dump_json(PostList.validate_python(posts, from_attributes=True))
+    headers.update(conditional.page_headers(versions, variant))
+    if cacheable:
+        # votes evict pages showing the voted post; a post climbing into a hot/top page shows up once the entry expires
+        await response_cache.set(cache_key, body, ["feed", *(f"post:{id}" for id, _ in versions)], headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@router.post("/lookup", response_model=schemas.PostLookupReturn)
+async def lookup_posts(lookup: schemas.PostLookup, db: AsyncSession = Depends(get_read_db)):
+    # for clients rendering lists of known posts (notifications, bookmarks) instead of one GET /posts/{id} each.
+    # Repeated ids are returned once, at their first position.
+    ids = list(dict.fromkeys(lookup.ids))
+    found = {post.id: post for post in (await db.scalars(LOOKUP_POSTS, {"ids": ids})).unique()}
+    posts = [found[id] for id in ids if id in found]
+    body = schemas.PostLookupReturn(posts=PostList.validate_python(posts, from_attributes=True), missing_ids=[id for id in ids if id not in found])
+    return Response(content=body.model_dump_json(), media_type="application/json")
 
-    # Serialize the response
-    posts = []
-    for post, votes in results:
-        # `post.owner` is now loaded
-        post_dict = jsonable_encoder(post)
-        post_dict["owner"] = jsonable_encoder(post.owner)    # <-- add owner 
-        post_dict["votes"] = votes
-        posts.append(post_dict)
+async def stream_posts(query, compress: bool, db: AsyncSession):
+    # takes its own session: a request-scoped dependency session is closed before the body is streamed
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16) if compress else None
+    async with db:
+        result = await db.stream_scalars(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        async for posts in result.partitions():
+            chunk = b"".join(schemas.PostReturnWithVotes.model_validate(post, from_attributes=True).model_dump_json().encode() + b"\n" for post in posts)
+            yield compressor.compress(chunk) if compressor else chunk
+    if compressor:
+        yield compressor.flush()
 
-    return posts
+@router.get("/export")
+async def export_posts(request: Request, owner_id: Optional[int] = None, created_from: Optional[datetime] = None, created_to: Optional[datetime] = None):
+    query = select(models.Post).options(joinedload(models.Post.owner)).order_by(models.Post.id)
+    if owner_id is not None:
+        query = query.where(models.Post.owner_id == owner_id)
+    if created_from is not None:
+        query = query.where(models.Post.created_at >= created_from)
+    if created_to is not None:
+        query = query.where(models.Post.created_at < created_to)
+    compress = "gzip" in request.headers.get("accept-encoding", "")
+    return StreamingResponse(stream_posts(query, compress, read_session(request)), media_type="application/x-ndjson", headers={"Content-Encoding": "gzip"} if compress else None)
 
     
 
 @router.get("/{id}", response_model=schemas.PostReturnWithVotes)
-def get_post(id: int, db: Session = Depends(get_db)):
-    post = db.query(models.Post, func.count(models.Vote.post_id).label("votes")).join(models.Vote, models.Post.id == models.Vote.post_id, isouter=True).group_by(models.Post.id).filter(models.Post.id == id).first()
+async def get_post(id: int, request: Request, db: AsyncSession = Depends(get_read_db)):
+    cache_key = response_cache.key("/posts/{id}", id=id)
+    cached = None if db.info["read_your_writes"] else await response_cache.get("/posts/{id}", cache_key)
+    if cached is not None:
+        return conditional.not_modified(cached.headers) if conditional.is_fresh(request, cached.headers) else cached
+    if conditional.is_conditional(request):
+        # a primary key lookup of the version alone; the owner join and serialization only run if it changed
+        updated_at = await db.scalar(lambda_stmt(lambda: select(models.Post.updated_at).where(models.Post.id == id)))
+        if updated_at is not None and conditional.is_fresh(request, conditional.post_headers(id, updated_at)):
+            return conditional.not_modified(conditional.post_headers(id, updated_at))
+    # a lambda statement is cached by its code location, so it skips both construction and cache key generation
+    post = await db.scalar(lambda_stmt(lambda: select(models.Post).options(joinedload(models.Post.owner)).where(models.Post.id == id)))
     if post:
-        post_obj, votes = post
-        post_data = {
-            **post_obj.__dict__,  # Convert the Post object to a dictionary
-            "votes": votes,
-            "owner": post_obj.owner  # Validate owner using UserOut
-        }
-        return post_data
+        headers = conditional.post_headers(post.id, post.updated_at)
+        body = schemas.PostReturnWithVotes.model_validate(post, from_attributes=True).model_dump_json().encode()
+        await response_cache.set(cache_key, body, [f"post:{id}"], headers)
+        return Response(content=body, media_type="application/json", headers=headers)
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"post with ID {id} was not found.")
 
 @router.delete("/{id}")
-def delete_post(id: int, db: Session = Depends(get_db), current_user: int = Depends(oauth2.get_current_user)):
-    post_query = db.query(models.Post).filter(models.Post.id == id)
-    post = post_query.first()
+async def delete_post(id: int, db: AsyncSession = Depends(get_db), current_user: int = Depends(oauth2.get_current_user)):
+    post = await db.get(models.Post, id)
     if not post:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                          detail=f"post with ID {id} was not found so it was not deleted.") 
     if post.owner_id != current_user.id:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=f"Post with ID {id} doesn't belong to the current user to delete it.")
-    post_query.delete()
-    db.commit()
+    await db.execute(invalidation.notifying(delete(models.Post).where(models.Post.id == id)), {"invalidations": invalidation.payloads("feed", f"post:{id}")})
+    await db.commit()
+    await response_cache.invalidate("feed", f"post:{id}")
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 @router.put("/{id}", response_model=schemas.PostReturn)
-def update_post(newPost: schemas.PostCreate, id: int, db: Session = Depends(get_db), current_user: int = Depends(oauth2.get_current_user)):
-    post_query = db.query(models.Post).filter(models.Post.id == id)
-    post = post_query.first()
+async def update_post(newPost: schemas.PostCreate, id: int, db: AsyncSession = Depends(get_db), current_user: int = Depends(oauth2.get_current_user)):
+    post = await db.get(models.Post, id)
     if not post:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                          detail=f"post with ID {id} was not found")
     if post.owner_id != current_user.id:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=f"Post with ID {id} doesn't belong to the current user to edit it.")
-    post_query.update(newPost.model_dump(), synchronize_session=False)
-    db.commit()
-    return post_query.first()  
+    # updated_at is a new version for conditional GETs, even if the fields were set to what they
+    # already were. The returned row refreshes the loaded post; the NOTIFY travels with the UPDATE.
+    await db.execute(UPDATE_POST, {**newPost.model_dump(), "post_id": id, "invalidations": invalidation.payloads("feed", f"post:{id}")})
+    await db.commit()
+    # the owner is the current user, a detached, already loaded user; attaching it costs no query
+    set_committed_value(post, "owner", current_user)
+    await response_cache.invalidate("feed", f"post:{id}")
+    return post
 
 # while True:
 #     try:
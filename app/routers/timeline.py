@@ -0,0 +1,24 @@
+from fastapi import APIRouter, Response, Depends, Query
+from typing import List, Optional
+from datetime import datetime
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+from sqlalchemy import select
+from .. import models, schemas, oauth2, pagination, timeline
+from ..database import get_read_db
+router = APIRouter(
+    prefix = "/timeline",
+    tags = ["Timeline"])
+
+@router.get("/", response_model=List[schemas.PostReturnWithVotes])
+async def get_timeline(response: Response, db: AsyncSession = Depends(get_read_db), current_user: int = Depends(oauth2.get_current_user), limit: int = Query(10, ge=1, le=pagination.MAX_PAGE_SIZE), cursor: Optional[str] = None):
+    # posts from followed accounts, newest first; keyset paginated on (created_at, id) like GET /posts
+    after = pagination.decode_cursor(cursor, datetime, int) if cursor else None
+    # fetch one extra entry to know whether there is a next page
+    entries = timeline.timeline_entries(current_user.id, limit + 1, after).subquery()
+    query = select(models.Post).join(entries, models.Post.id == entries.c.post_id).options(joinedload(models.Post.owner)).order_by(entries.c.created_at.desc(), entries.c.post_id.desc())
+    posts = (await db.scalars(query)).all()
+    if len(posts) > limit:
+        posts = posts[:limit]
+        response.headers["X-Next-Cursor"] = pagination.encode_cursor(posts[-1].created_at, posts[-1].id)
+    return posts
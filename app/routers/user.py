@@ -1,7 +1,7 @@
 from fastapi import FastAPI, HTTPException, status, Response, Depends, APIRouter
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from .. import models, schemas, utils
-from ..database import get_db
+from ..database import get_db, get_read_db
 
 router = APIRouter(
     prefix = "/users",
@@ -9,20 +9,20 @@ router = APIRouter(
 )
 
 @router.post("/", response_model=schemas.UserOut)
-def add_user(user: schemas.CreateUser, db: Session = Depends(get_db)):
-    user.password = utils.hashPassword(user.password)
+async def add_user(user: schemas.CreateUser, db: AsyncSession = Depends(get_db)):
+    user.password = await utils.async_hash_password(user.password)
     newUser = models.User(**user.model_dump())
     try:
         db.add(newUser)
-        db.commit()
-        db.refresh(newUser)
+        await db.commit()
+        await db.refresh(newUser)
         return newUser
     except Exception as error:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"{error}")
     
 @router.get("/{id}", response_model=schemas.UserOut)
-def get_user(id: int, db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.id == id).first()
+async def get_user(id: int, db: AsyncSession = Depends(get_read_db)):
+    user = await db.get(models.User, id)
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"user with id {id} is not found!")
     return user
\ No newline at end of file
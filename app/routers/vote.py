@@ -1,40 +1,67 @@
+import asyncio
 from fastapi import APIRouter, HTTPException, status, Response, Depends
-from sqlalchemy.orm import Session
-from .. import schemas, models, oauth2
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, any_, bindparam, Integer
+from sqlalchemy.dialects.postgresql import ARRAY
+from .. import schemas, models, oauth2, votes, admission
+from ..cache import response_cache
+from ..config import settings
 from ..database import get_db
+from ..vote_buffer import vote_buffer
 router = APIRouter(
     prefix = "/votes",
     tags = ["Votes"])
 
-@router.post("/", status_code=status.HTTP_201_CREATED, response_model=schemas.VoteReturn)
-def submitVote(vote: schemas.VoteCreate, current_user: int = Depends(oauth2.get_current_user), db: Session = Depends(get_db)):
-    current_vote_query = db.query(models.Vote).filter(models.Vote.user_id == current_user.id, models.Vote.post_id == vote.post_id)
-    current_vote = current_vote_query.first()
+@router.post("/", status_code=status.HTTP_201_CREATED, response_model=schemas.VoteReturn, dependencies=[Depends(admission.limit_votes)])
+async def submitVote(vote: schemas.VoteCreate, current_user: int = Depends(oauth2.get_current_user), db: AsyncSession = Depends(get_db)):
+    if settings.vote_buffer_enabled:
+        # group commit: answered once the flush holding the vote has committed (see vote_buffer.py)
+        stored = vote_buffer.add(current_user.id, vote.post_id, vote.vote_dir)
+        # the wait needs no connection; give back the one the current user lookup may hold
+        await db.close()
+        if not await stored:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Post with ID {vote.post_id} doesn't exist")
+        return {"user_id": current_user.id, **vote.model_dump()}
     try:
-        if not current_vote:
-            newVote = models.Vote(user_id=current_user.id, **vote.model_dump())
-            db.add(newVote)
-            db.commit()
-            db.refresh(newVote)
-            return newVote
-        if current_vote.vote_dir == vote.vote_dir:
-            return current_vote
-        newVoteAsDict = vote.model_dump()
-        newVoteAsDict['user_id'] = current_user.id
-        current_vote_query.update(newVoteAsDict, synchronize_session=False)
-        db.commit()
-        return current_vote_query.first()
-    except:
+        newVote, = await votes.upsert_votes(db, [{"user_id": current_user.id, **vote.model_dump()}], [f"post:{vote.post_id}"])
+    except IntegrityError:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Post with ID {vote.post_id} doesn't exist")
+    await db.commit()
+    await response_cache.invalidate(f"post:{vote.post_id}")
+    return newVote
+
+@router.post("/batch", response_model=schemas.VoteBatchReturn)
+async def submitVotes(batch: schemas.VoteBatch, current_user: int = Depends(oauth2.get_current_user), db: AsyncSession = Depends(get_db)):
+    # the last vote queued for a post wins
+    latest = {vote.post_id: vote.vote_dir for vote in batch.votes}
+    # batches share the single-vote limit at one token per post; VoteBatch caps them at the burst
+    admission.vote_bucket.take(current_user.id, len(latest))
+    if settings.vote_buffer_enabled:
+        futures = [vote_buffer.add(current_user.id, post_id, vote_dir) for post_id, vote_dir in latest.items()]
+        await db.close()
+        stored = dict(zip(latest, await asyncio.gather(*futures)))
+        return {"votes": [{"user_id": current_user.id, "post_id": post_id, "vote_dir": vote_dir} for post_id, vote_dir in latest.items() if stored[post_id]], "missing_post_ids": [post_id for post_id in latest if not stored[post_id]]}
+    # FOR KEY SHARE keeps the found posts from being deleted before the votes land
+    existing = set(await db.scalars(select(models.Post.id).where(models.Post.id == any_(bindparam("post_ids", list(latest), type_=ARRAY(Integer)))).with_for_update(key_share=True)))
+    applied = await votes.upsert_votes(db, [{"user_id": current_user.id, "post_id": post_id, "vote_dir": vote_dir} for post_id, vote_dir in latest.items() if post_id in existing], [f"post:{post_id}" for post_id in existing]) if existing else []
+    await db.commit()
+    await response_cache.invalidate(*(f"post:{vote.post_id}" for vote in applied))
+    return {"votes": applied, "missing_post_ids": [post_id for post_id in latest if post_id not in existing]}
 
 @router.delete("/", status_code=status.HTTP_204_NO_CONTENT)
-def deleteVote(vote: schemas.Vote, current_user: int = Depends(oauth2.get_current_user), db: Session = Depends(get_db)):
-    current_vote_query = db.query(models.Vote).filter(models.Vote.user_id == current_user.id, models.Vote.post_id == vote.post_id)
-    current_vote = current_vote_query.first()
-    if not current_vote:
+async def deleteVote(vote: schemas.Vote, current_user: int = Depends(oauth2.get_current_user), db: AsyncSession = Depends(get_db)):
+    if settings.vote_buffer_enabled:
+        # queued behind any buffered vote of the same post, so it can't be overtaken
+        removed = vote_buffer.add(current_user.id, vote.post_id, None)
+        await db.close()
+        if not await removed:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Vote of post with ID {vote.post_id} doesn't exist")
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
+    if not await votes.delete_vote(db, current_user.id, vote.post_id, [f"post:{vote.post_id}"]):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Vote of post with ID {vote.post_id} doesn't exist")
-    current_vote_query.delete()
-    db.commit()
+    await db.commit()
+    await response_cache.invalidate(f"post:{vote.post_id}")
     return Response(status_code=status.HTTP_204_NO_CONTENT)
     
 #@router.put("/", response_model=schemas.VoteReturn)
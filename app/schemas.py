@@ -1,6 +1,7 @@
-from pydantic import BaseModel, EmailStr, conint
+from pydantic import BaseModel, EmailStr, conint, conlist
 from datetime import datetime
-from typing import Optional
+from typing import Optional, List
+from .config import settings
 
 class PostBase(BaseModel):
     title: str
@@ -46,6 +47,8 @@ class Token(BaseModel):
     
 class TokenData(BaseModel):
     id: Optional[int] = None
+    email: Optional[EmailStr] = None
+    created_at: Optional[datetime] = None
     
 class Vote(BaseModel):
     post_id: int
@@ -54,4 +57,35 @@ class VoteCreate(Vote):
     vote_dir: conint(le=1, ge=0)
     
 class VoteReturn(VoteCreate):
-    user_id: int
\ No newline at end of file
+    user_id: int
+    
+class VoteBatch(BaseModel):
+    # each vote costs a token of the vote rate limit, so a batch can't be larger than its burst
+    votes: conlist(VoteCreate, min_length=1, max_length=settings.vote_burst)
+    
+class VoteBatchReturn(BaseModel):
+    votes: List[VoteReturn]
+    missing_post_ids: List[int]
+class PostLookup(BaseModel):
+    ids: conlist(int, min_length=1, max_length=500)
+
+class PostLookupReturn(BaseModel):
+    # found posts in the order their ids were requested
+    posts: List[PostReturnWithVotes]
+    missing_ids: List[int]
+
+class BulkPostError(BaseModel):
+    index: int
+    errors: List[dict]
+
+class BulkPostReturn(BaseModel):
+    # ids[i] is the id created for item i, or None if it was rejected
+    ids: List[Optional[int]]
+    errors: List[BulkPostError]
+
+class Follow(BaseModel):
+    user_id: int
+
+class FollowReturn(BaseModel):
+    follower_id: int
+    followee_id: int
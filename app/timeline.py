@@ -0,0 +1,71 @@
+from sqlalchemy import select, update, delete, tuple_, union, true, literal, any_, bindparam, Integer
+from sqlalchemy.dialects.postgresql import insert as pg_insert, ARRAY
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models
+from .config import settings
+
+# Home timelines. Posts are copied into their followers' timeline_entries when they are
+# written (fan-out-on-write), except for authors with more than
+# timeline_fanout_max_followers followers: copying every one of their posts to every
+# follower costs too much, so timelines read those authors' newest posts directly instead.
+
+def _fans_out():
+    return models.User.followers_count <= settings.timeline_fanout_max_followers
+
+async def fan_out(db: AsyncSession, post_ids: list):
+    # one INSERT .. SELECT for any number of new posts; runs in the caller's transaction
+    if not post_ids:
+        return
+    entries = select(models.Follow.follower_id, models.Post.id, models.Post.created_at).join(
+        models.Post, models.Post.owner_id == models.Follow.followee_id,
+    ).join(models.User, models.User.id == models.Post.owner_id).where(
+        models.Post.id == any_(bindparam("post_ids", post_ids, type_=ARRAY(Integer))), _fans_out(),
+    )
+    # a concurrent follow may already have backfilled some of these
+    await db.execute(pg_insert(models.TimelineEntry).from_select(["user_id", "post_id", "created_at"], entries).on_conflict_do_nothing())
+
+async def follow(db: AsyncSession, follower_id: int, followee_id: int):
+    # returns False if the follow already existed; raises IntegrityError if the followee doesn't exist
+    followed = pg_insert(models.Follow).values(follower_id=follower_id, followee_id=followee_id).on_conflict_do_nothing().returning(models.Follow.followee_id).cte("followed")
+    counted = update(models.User).where(models.User.id == followed.c.followee_id).values(followers_count=models.User.followers_count + 1).returning(models.User.id).cte("counted")
+    if (await db.execute(select(followed.c.followee_id).add_cte(counted))).first() is None:
+        return False
+    # start the timeline off with the account's latest posts
+    recent = select(literal(follower_id, Integer), models.Post.id, models.Post.created_at).join(models.User, models.User.id == models.Post.owner_id).where(
+        models.Post.owner_id == followee_id, _fans_out(),
+    ).order_by(models.Post.created_at.desc(), models.Post.id.desc()).limit(settings.timeline_backfill_posts)
+    await db.execute(pg_insert(models.TimelineEntry).from_select(["user_id", "post_id", "created_at"], recent).on_conflict_do_nothing())
+    return True
+
+async def unfollow(db: AsyncSession, follower_id: int, followee_id: int):
+    unfollowed = delete(models.Follow).where(models.Follow.follower_id == follower_id, models.Follow.followee_id == followee_id).returning(models.Follow.followee_id).cte("unfollowed")
+    stmt = update(models.User).where(models.User.id == unfollowed.c.followee_id).values(followers_count=models.User.followers_count - 1).returning(models.User.id).execution_options(synchronize_session=False)
+    if (await db.execute(stmt)).first() is None:
+        return False
+    await db.execute(delete(models.TimelineEntry).where(
+        models.TimelineEntry.user_id == follower_id,
+        models.TimelineEntry.post_id.in_(select(models.Post.id).where(models.Post.owner_id == followee_id)),
+    ))
+    return True
+
+def timeline_entries(user_id: int, limit: int, after: tuple = None):
+    # (post_id, created_at) of the user's next `limit` timeline posts, newest first, after the
+    # (created_at, post_id) of the previous page. Both halves are index range scans.
+    fanned = select(models.TimelineEntry.post_id, models.TimelineEntry.created_at).where(models.TimelineEntry.user_id == user_id)
+    if after:
+        fanned = fanned.where(tuple_(models.TimelineEntry.created_at, models.TimelineEntry.post_id) < tuple_(*after))
+    fanned = fanned.order_by(models.TimelineEntry.created_at.desc(), models.TimelineEntry.post_id.desc()).limit(limit)
+
+    # followed accounts that are not fanned out, each read through ix_posts_owner_id_created_at_id
+    pulled_from = select(models.Follow.followee_id).join(models.User, models.User.id == models.Follow.followee_id).where(
+        models.Follow.follower_id == user_id, ~_fans_out(),
+    ).subquery()
+    recent = select(models.Post.id.label("post_id"), models.Post.created_at).where(models.Post.owner_id == pulled_from.c.followee_id)
+    if after:
+        recent = recent.where(tuple_(models.Post.created_at, models.Post.id) < tuple_(*after))
+    recent = recent.order_by(models.Post.created_at.desc(), models.Post.id.desc()).limit(limit).lateral()
+    pulled = select(recent.c.post_id, recent.c.created_at).select_from(pulled_from).join(recent, true())
+
+    # UNION rather than UNION ALL: an author that crossed the threshold can be in both halves
+    entries = union(fanned, pulled).subquery()
+    return select(entries.c.post_id, entries.c.created_at).order_by(entries.c.created_at.desc(), entries.c.post_id.desc()).limit(limit)
@@ -1,9 +1,97 @@
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from fastapi import HTTPException, status
 from passlib.context import CryptContext
+from .config import settings
+from . import metrics
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# hashes made with other cost settings are flagged by verify_and_update and rehashed on login
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.bcrypt_rounds)
 
 def hashPassword(password: str):
     return pwd_context.hash(password)
 
 def verify_password(password:str, hashedpassword: str):
-    return pwd_context.verify(password, hashedpassword)
\ No newline at end of file
+    return pwd_context.verify(password, hashedpassword)
+
+def verify_and_update_password(password: str, hashedpassword: str):
+    # (valid, new_hash); new_hash is None unless the stored hash uses outdated cost settings
+    return pwd_context.verify_and_update(password, hashedpassword)
+
+# bcrypt is CPU bound, so it runs on a dedicated process pool instead of the event loop or
+# the request threads. Calls beyond the workers plus the queue limit are rejected with a 503.
+# A worker that dies (e.g. OOM-killed) breaks the whole pool; it is replaced and the call retried once.
+_executor = None
+_in_flight = 0
+
+password_hash_seconds = metrics.Histogram("password_hash_seconds", "Time from queueing a bcrypt call to its result, by operation")
+password_hash_rejected = metrics.Counter("password_hash_rejected_total", "bcrypt calls rejected because the queue was full")
+password_pool_broken = metrics.Counter("password_pool_broken_total", "bcrypt calls that found the process pool broken by a dead worker")
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        # spawn: forking a process that holds event loop threads and open sockets is unsafe
+        _executor = ProcessPoolExecutor(max_workers=settings.password_hash_workers, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+def _warm_up():
+    # loads the bcrypt backend and pays for one hash, so the first login doesn't
+    return pwd_context.dummy_verify()
+
+def _replace_broken(executor):
+    global _executor
+    # every call in flight on the broken pool lands here; only the first replaces it
+    if _executor is executor:
+        _executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+async def _submit(func, *args):
+    executor = _get_executor()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+    except BrokenProcessPool:
+        _replace_broken(executor)
+        raise
+
+async def _run_in_pool(func, *args):
+    global _in_flight
+    if _in_flight >= settings.password_hash_workers + settings.password_hash_queue_size:
+        password_hash_rejected.inc()
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Too many password checks in progress, try again later", headers={"Retry-After": "1"})
+    _in_flight += 1
+    start = time.perf_counter()
+    try:
+        try:
+            return await _submit(func, *args)
+        except BrokenProcessPool:
+            password_pool_broken.inc()
+            try:
+                return await _submit(func, *args)
+            except BrokenProcessPool:
+                password_pool_broken.inc()
+                raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Password checks are unavailable, try again later", headers={"Retry-After": "1"})
+    finally:
+        _in_flight -= 1
+        password_hash_seconds.observe(time.perf_counter() - start, operation=func.__name__)
+
+async def async_hash_password(password: str):
+    return await _run_in_pool(hashPassword, password)
+
+async def async_verify_password(password: str, hashedpassword: str):
+    return await _run_in_pool(verify_and_update_password, password, hashedpassword)
+
+async def start_password_pool():
+    # spawning the workers takes a second or more; do it at startup instead of in the first logins
+    executor = _get_executor()
+    loop = asyncio.get_running_loop()
+    await asyncio.gather(*(loop.run_in_executor(executor, _warm_up) for _ in range(settings.password_hash_workers)))
+
+def shutdown_password_pool():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
+        _executor = None
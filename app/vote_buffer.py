@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import time
+from fastapi import HTTPException, status
+from sqlalchemy import select, any_, bindparam, Integer
+from sqlalchemy.dialects.postgresql import ARRAY
+from . import metrics, models, votes, invalidation
+from .cache import response_cache
+from .config import settings
+from .database import AsyncSessionLocal
+
+# Group-committed votes, enabled with vote_buffer_enabled. The vote endpoints put each vote into a
+# per-worker buffer keyed by (user_id, post_id), where a later vote replaces an earlier one and a
+# removal is kept as a None vote_dir, and wait. A background task writes the buffer out as one
+# transaction of batched statements once its first vote has waited vote_buffer_flush_seconds, or
+# as soon as it holds vote_buffer_flush_size votes. Thousands of votes on a viral post then cost
+# one update of its counter per flush instead of one transaction each.
+#
+# Acknowledgement: add() returns a future that resolves only after the flush holding the vote has
+# committed, and the endpoints answer once it does. A vote is never acknowledged before it is stored.
+#   - The future resolves to whether the vote was applied: False for a vote on a post that doesn't
+#     exist, or the removal of a vote that doesn't. A vote replaced by a later one of the same
+#     user and post is acknowledged along with it.
+#   - A failed flush acknowledges nothing. Its votes go back (behind any newer vote for the same
+#     key) and are retried after RETRY_SECONDS; their requests keep waiting.
+#   - A crash loses only votes that were never acknowledged. A clean shutdown flushes the buffer,
+#     and votes it could not store are answered with 503.
+#   - While the buffer holds vote_buffer_max_votes votes (flushes are failing), new votes get 503.
+
+# pause after a failed flush before the next attempt
+RETRY_SECONDS = 1
+
+logger = logging.getLogger(__name__)
+
+flush_size = metrics.Histogram("vote_buffer_flush_size", "Votes written per vote buffer flush", buckets=(1, 10, 50, 100, 500, 1000, 5000, 10000))
+flush_lag = metrics.Histogram("vote_buffer_lag_seconds", "Age of the oldest vote in each flush when it commits, i.e. the longest a vote request waited for its flush")
+flushes = metrics.Counter("vote_buffer_flushes_total", "Vote buffer flushes by result")
+dropped = metrics.Counter("vote_buffer_dropped_total", "Buffered votes not applied at flush because their post does not exist")
+
+# FOR KEY SHARE keeps the found posts from being deleted before the votes land
+EXISTING_POSTS = select(models.Post.id).where(models.Post.id == any_(bindparam("post_ids", type_=ARRAY(Integer)))).with_for_update(key_share=True)
+
+def _resolve(future, result):
+    # a request that gave up waiting has cancelled its future
+    if not future.done():
+        future.set_result(result)
+
+class VoteBuffer:
+    def __init__(self, flush_seconds: float, flush_size: int, max_votes: int):
+        self.flush_seconds = flush_seconds
+        self.flush_size = flush_size
+        self.max_votes = max_votes
+        # (user_id, post_id) -> vote_dir, or None to remove the vote
+        self.pending = {}
+        # (user_id, post_id) -> futures of the requests waiting for it, oldest first
+        self.waiters = {}
+        # when the oldest vote still in `pending` was accepted
+        self.oldest = None
+        self.arrived = asyncio.Event()
+        self.full = asyncio.Event()
+        self.task = None
+
+    def add(self, user_id: int, post_id: int, vote_dir):
+        if len(self.pending) >= self.max_votes and (user_id, post_id) not in self.pending:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Votes are backed up, try again later", headers={"Retry-After": str(RETRY_SECONDS)})
+        self.pending[user_id, post_id] = vote_dir
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.setdefault((user_id, post_id), []).append(future)
+        if self.oldest is None:
+            self.oldest = time.monotonic()
+        self.arrived.set()
+        if len(self.pending) >= self.flush_size:
+            self.full.set()
+        return future
+
+    async def flush(self):
+        # returns False if the flush failed and its votes are waiting for the next one
+        if not self.pending:
+            return True
+        # swapped out in one step; votes arriving during the flush go into the next one
+        batch, waiters, oldest = self.pending, self.waiters, self.oldest
+        self.pending, self.waiters, self.oldest = {}, {}, None
+        try:
+            async with AsyncSessionLocal() as db:
+                upserts = [(key, vote_dir) for key, vote_dir in batch.items() if vote_dir is not None]
+                existing = set(await db.scalars(EXISTING_POSTS, {"post_ids": list({post_id for (_, post_id), _ in upserts})})) if upserts else set()
+                applied = await votes.upsert_votes(db, [{"user_id": user_id, "post_id": post_id, "vote_dir": vote_dir} for (user_id, post_id), vote_dir in upserts if post_id in existing]) if existing else []
+                removals = [key for key, vote_dir in batch.items() if vote_dir is None]
+                removed = await votes.delete_votes(db, removals) if removals else []
+                stored = {(vote.user_id, vote.post_id) for vote in [*applied, *removed]}
+                tags = {f"post:{post_id}" for _, post_id in stored}
+                await invalidation.publish(db, *tags)
+                await db.commit()
+        except BaseException as error:
+            # newer votes for the same keys arrived meanwhile and win; their requests wait behind
+            # these ones. A cancelled flush (shutdown) puts its votes back too, for stop().
+            for key, vote_dir in batch.items():
+                self.pending.setdefault(key, vote_dir)
+            for key, futures in waiters.items():
+                self.waiters[key] = futures + self.waiters.get(key, [])
+            self.oldest = oldest if self.oldest is None else min(oldest, self.oldest)
+            if not isinstance(error, Exception):
+                raise
+            flushes.inc(result="error")
+            logger.exception("vote buffer flush of %d votes failed, keeping them for the next one", len(batch))
+            return False
+        flushes.inc(result="ok")
+        flush_size.observe(len(batch))
+        flush_lag.observe(time.monotonic() - oldest)
+        if len(upserts) > len(applied):
+            dropped.inc(len(upserts) - len(applied))
+        await response_cache.invalidate(*tags)
+        # only now that the votes are stored and the cache is fresh are their requests answered
+        for key, futures in waiters.items():
+            for future in futures[:-1]:
+                _resolve(future, True)
+            _resolve(futures[-1], key in stored)
+        return True
+
+    async def run(self):
+        while True:
+            await self.arrived.wait()
+            # give the first vote's companions a moment to join its flush
+            try:
+                await asyncio.wait_for(self.full.wait(), self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self.arrived.clear()
+            self.full.clear()
+            if not await self.flush():
+                await asyncio.sleep(RETRY_SECONDS)
+            if self.pending:
+                self.arrived.set()
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        # a clean shutdown stores everything that is waiting
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        if not await self.flush():
+            # nothing was acknowledged, so nothing is lost; the requests are told to retry
+            for futures in self.waiters.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Server is shutting down, try again", headers={"Retry-After": str(RETRY_SECONDS)}))
+            self.pending, self.waiters, self.oldest = {}, {}, None
+
+vote_buffer = VoteBuffer(settings.vote_buffer_flush_seconds, settings.vote_buffer_flush_size, settings.vote_buffer_max_votes)
+
+metrics.Gauge("vote_buffer_pending", "Votes waiting in this worker to be stored", lambda: {(): len(vote_buffer.pending)})
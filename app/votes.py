@@ -0,0 +1,77 @@
+from sqlalchemy import select, update, delete, func, literal_column, cast, bindparam, Float, Integer
+from sqlalchemy.dialects.postgresql import insert, ARRAY
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models, invalidation
+from .config import settings
+
+# Vote writes shared by the vote endpoints. Each one is a single statement: the vote
+# change, the posts.votes_count bump and the invalidation NOTIFY travel together in CTEs.
+
+def hot_score(votes, created_at):
+    # SQL expression for posts.hot_score: decays with age, so it is refreshed whenever the count
+    # changes here and periodically for every recent post by the decay-hot-scores command
+    age_hours = func.extract("epoch", func.now() - created_at) / 3600
+    return cast(votes, Float) / func.power(cast(age_hours, Float) + 2, settings.hot_gravity)
+
+# Both statements are built once with bound parameters. Votes travel as three parallel arrays
+# unnested into rows, which keeps the upsert a single SQL string whatever the batch size, so
+# asyncpg reuses one prepared statement for it. SQLAlchemy never caches the compiled form of a
+# postgresql insert (it has no cache key), so that part is still compiled on every call.
+_rows = func.unnest(
+    bindparam("user_ids", type_=ARRAY(Integer)),
+    bindparam("post_ids", type_=ARRAY(Integer)),
+    bindparam("vote_dirs", type_=ARRAY(Integer)),
+).table_valued("user_id", "post_id", "vote_dir").render_derived()
+_insert = insert(models.Vote).from_select(["user_id", "post_id", "vote_dir"], select(_rows.c.user_id, _rows.c.post_id, _rows.c.vote_dir))
+_upserted = _insert.on_conflict_do_update(
+    index_elements=[models.Vote.user_id, models.Vote.post_id],
+    set_={"vote_dir": _insert.excluded.vote_dir},
+).returning(
+    models.Vote.user_id, models.Vote.post_id, models.Vote.vote_dir,
+    # xmax is only zero on rows this statement inserted rather than updated
+    literal_column("xmax = 0").label("inserted"),
+).cte("upserted")
+_added = select(_upserted.c.post_id, func.count().label("votes")).where(_upserted.c.inserted).group_by(_upserted.c.post_id).subquery()
+_counted = update(models.Post).where(models.Post.id == _added.c.post_id).values(
+    votes_count=models.Post.votes_count + _added.c.votes,
+    updated_at=func.now(),
+    hot_score=hot_score(models.Post.votes_count + _added.c.votes, models.Post.created_at),
+).returning(models.Post.id).cte("counted")
+UPSERT_VOTES = invalidation.notifying(select(_upserted).add_cte(_counted))
+
+_deleted = delete(models.Vote).where(models.Vote.user_id == bindparam("user_id"), models.Vote.post_id == bindparam("post_id")).returning(models.Vote.post_id, models.Vote.vote_dir).cte("deleted")
+DELETE_VOTE = invalidation.notifying(update(models.Post).where(models.Post.id == _deleted.c.post_id).values(
+    votes_count=models.Post.votes_count - 1,
+    updated_at=func.now(),
+    hot_score=hot_score(models.Post.votes_count - 1, models.Post.created_at),
+).returning(_deleted.c.post_id, _deleted.c.vote_dir).execution_options(synchronize_session=False))
+
+# batched form of DELETE_VOTE, for the vote buffer: removes the listed (user_id, post_id) votes
+_gone = func.unnest(
+    bindparam("user_ids", type_=ARRAY(Integer)),
+    bindparam("post_ids", type_=ARRAY(Integer)),
+).table_valued("user_id", "post_id").render_derived()
+_deleted_many = delete(models.Vote).where(models.Vote.user_id == _gone.c.user_id, models.Vote.post_id == _gone.c.post_id).returning(models.Vote.user_id, models.Vote.post_id).cte("deleted")
+_removed = select(_deleted_many.c.post_id, func.count().label("votes")).group_by(_deleted_many.c.post_id).subquery()
+_uncounted = update(models.Post).where(models.Post.id == _removed.c.post_id).values(
+    votes_count=models.Post.votes_count - _removed.c.votes,
+    updated_at=func.now(),
+    hot_score=hot_score(models.Post.votes_count - _removed.c.votes, models.Post.created_at),
+).returning(models.Post.id).cte("uncounted")
+DELETE_VOTES = select(_deleted_many).add_cte(_uncounted)
+
+async def upsert_votes(db: AsyncSession, votes: list, tags=()):
+    # votes: dicts of user_id, post_id, vote_dir with at most one entry per (user_id, post_id).
+    # Sorted so concurrent batches lock votes and posts rows in the same order. tags are
+    # announced to the other workers by the same statement.
+    votes = sorted(votes, key=lambda vote: (vote["post_id"], vote["user_id"]))
+    params = {"user_ids": [vote["user_id"] for vote in votes], "post_ids": [vote["post_id"] for vote in votes], "vote_dirs": [vote["vote_dir"] for vote in votes]}
+    return (await db.execute(UPSERT_VOTES, {**params, "invalidations": invalidation.payloads(*tags)})).all()
+
+async def delete_vote(db: AsyncSession, user_id: int, post_id: int, tags=()):
+    return (await db.execute(DELETE_VOTE, {"user_id": user_id, "post_id": post_id, "invalidations": invalidation.payloads(*tags)})).first()
+
+async def delete_votes(db: AsyncSession, votes: list):
+    # votes: (user_id, post_id) pairs; returns the (user_id, post_id) of each vote that existed
+    votes = sorted(votes, key=lambda vote: (vote[1], vote[0]))
+    return (await db.execute(DELETE_VOTES, {"user_ids": [user_id for user_id, _ in votes], "post_ids": [post_id for _, post_id in votes]})).all()
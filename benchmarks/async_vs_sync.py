@@ -0,0 +1,81 @@
+import argparse
+import asyncio
+import statistics
+import time
+import anyio
+from anyio import to_thread
+from sqlalchemy import create_engine, select, text
+from sqlalchemy.ext.asyncio import create_async_engine
+from app import models
+from app.database import SQLALCHEMY_DATABASE_URL, ASYNC_SQLALCHEMY_DATABASE_URL
+
+# Compares the old sync stack (psycopg2 behind Starlette's threadpool) with the async
+# stack (asyncpg on the event loop) by running the feed query from many concurrent
+# clients. Run with `python -m benchmarks.async_vs_sync` against a seeded database.
+
+FEED_QUERY = select(models.Post.id, models.Post.title, models.Post.votes_count).order_by(models.Post.created_at.desc(), models.Post.id.desc()).limit(10)
+SLEEP_QUERY = text("SELECT pg_sleep(:seconds)")
+
+async def drive(request, args):
+    # open the pool's connections before measuring
+    await asyncio.gather(*(request() for _ in range(args.pool_size)))
+    latencies = []
+
+    async def client():
+        for _ in range(args.requests // args.concurrency):
+            start = time.perf_counter()
+            await request()
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+    percentiles = statistics.quantiles(latencies, n=100)
+    return {"requests": len(latencies), "throughput": len(latencies) / elapsed, "p50": percentiles[49] * 1000, "p99": percentiles[98] * 1000}
+
+async def run_sync(args):
+    engine = create_engine(SQLALCHEMY_DATABASE_URL, pool_size=args.pool_size, max_overflow=0)
+    # Starlette runs plain `def` routes on anyio's default limiter of 40 threads
+    limiter = anyio.CapacityLimiter(args.threads)
+
+    def query():
+        with engine.connect() as conn:
+            if args.db_latency_ms:
+                conn.execute(SLEEP_QUERY, {"seconds": args.db_latency_ms / 1000})
+            conn.execute(FEED_QUERY).all()
+
+    async def request():
+        await to_thread.run_sync(query, limiter=limiter)
+
+    try:
+        return await drive(request, args)
+    finally:
+        engine.dispose()
+
+async def run_async(args):
+    engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, pool_size=args.pool_size, max_overflow=0)
+
+    async def request():
+        async with engine.connect() as conn:
+            if args.db_latency_ms:
+                await conn.execute(SLEEP_QUERY, {"seconds": args.db_latency_ms / 1000})
+            (await conn.execute(FEED_QUERY)).all()
+
+    try:
+        return await drive(request, args)
+    finally:
+        await engine.dispose()
+
+async def main(args):
+    for mode, run in (("sync", run_sync), ("async", run_async)):
+        result = await run(args)
+        print(f"{mode:>5}: {result['requests']} requests, {result['throughput']:.0f} req/s, p50 {result['p50']:.1f} ms, p99 {result['p99']:.1f} ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.async_vs_sync")
+    parser.add_argument("--concurrency", type=int, default=200, help="number of concurrent clients")
+    parser.add_argument("--requests", type=int, default=4000, help="total number of requests per mode")
+    parser.add_argument("--pool-size", type=int, default=50, help="connections available to each engine")
+    parser.add_argument("--threads", type=int, default=40, help="threadpool size of the sync mode")
+    parser.add_argument("--db-latency-ms", type=float, default=5, help="extra server-side latency per request, via pg_sleep")
+    asyncio.run(main(parser.parse_args()))
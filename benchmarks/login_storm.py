@@ -0,0 +1,51 @@
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+from collections import Counter
+import httpx
+from app.main import socialMediaApp
+
+# Floods /login from many clients while a single client keeps reading the feed, and
+# reports login throughput next to feed latency with and without the storm. Run with
+# `python -m benchmarks.login_storm`; the app runs in-process against the .env database.
+
+async def read_feed(client, stop, latencies):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await client.get("/posts/")
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(0.01)
+
+async def log_in(client, credentials, stop, statuses):
+    while not stop.is_set():
+        response = await client.post("/login", data=credentials)
+        statuses[response.status_code] += 1
+
+async def run_phase(client, credentials, logins, seconds):
+    stop = asyncio.Event()
+    latencies, statuses = [], Counter()
+    tasks = [asyncio.create_task(read_feed(client, stop, latencies))]
+    tasks += [asyncio.create_task(log_in(client, credentials, stop, statuses)) for _ in range(logins)]
+    await asyncio.sleep(seconds)
+    stop.set()
+    await asyncio.gather(*tasks)
+    percentiles = statistics.quantiles(latencies, n=100)
+    return {"logins_per_second": statuses[200] / seconds, "statuses": dict(statuses), "feed_p50": percentiles[49] * 1000, "feed_p99": percentiles[98] * 1000}
+
+async def main(args):
+    async with socialMediaApp.router.lifespan_context(socialMediaApp):
+        transport = httpx.ASGITransport(app=socialMediaApp)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            credentials = {"username": f"storm-{uuid.uuid4().hex[:8]}@example.com", "password": "storm-password"}
+            await client.post("/users/", json={"email": credentials["username"], "password": credentials["password"]})
+            for phase, logins in (("idle", 0), ("storm", args.logins)):
+                result = await run_phase(client, credentials, logins, args.seconds)
+                print(f"{phase:>5}: {result['logins_per_second']:.1f} logins/s {result['statuses']}, feed p50 {result['feed_p50']:.1f} ms, p99 {result['feed_p99']:.1f} ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.login_storm")
+    parser.add_argument("--logins", type=int, default=50, help="number of concurrent login clients during the storm")
+    parser.add_argument("--seconds", type=float, default=10, help="duration of each phase")
+    asyncio.run(main(parser.parse_args()))
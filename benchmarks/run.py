@@ -0,0 +1,140 @@
+import argparse
+import asyncio
+import json
+import platform
+import random
+import statistics
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+import httpx
+from sqlalchemy import select
+from app import models
+from app.database import SessionLocal
+from .seed import EMAIL_DOMAIN, PASSWORD, zipf_weights
+
+# Load test for the main routes against data from benchmarks.seed. Each route is driven on
+# its own by --concurrency clients for --requests requests and gets throughput, p50, p95,
+# p99 and error counts. Results are written as JSON; pass a previous result as --baseline
+# to print the change per route. Runs the app in-process through httpx by default, or
+# against a running server with --url.
+#
+#   python -m benchmarks.seed
+#   python -m benchmarks.run --out baseline.json
+#   python -m benchmarks.run --baseline baseline.json --out after.json
+
+def load_fixtures(tokens: int):
+    with SessionLocal() as db:
+        emails = db.scalars(select(models.User.email).where(models.User.email.like(f"%@{EMAIL_DOMAIN}")).order_by(models.User.id).limit(tokens)).all()
+        post_ids = db.scalars(select(models.Post.id).join(models.User).where(models.User.email.like(f"%@{EMAIL_DOMAIN}")).order_by(models.Post.id)).all()
+    if not emails or not post_ids:
+        raise SystemExit("no benchmark data, run `python -m benchmarks.seed` first")
+    return emails, post_ids
+
+def make_routes(emails, post_ids, headers, zipf, rng):
+    # route -> function sending one request; post ids are drawn with the same skew as the seeded votes
+    weights = zipf_weights(len(post_ids), zipf)
+    popular = lambda: rng.choices(post_ids, cum_weights=weights)[0]
+    return {
+        "POST /login": lambda client: client.post("/login", data={"username": rng.choice(emails), "password": PASSWORD}),
+        "GET /posts": lambda client: client.get("/posts/", params={"limit": 10}),
+        "GET /posts/{id}": lambda client: client.get(f"/posts/{popular()}"),
+        "POST /votes": lambda client: client.post("/votes/", json={"post_id": popular(), "vote_dir": 1}, headers=rng.choice(headers)),
+    }
+
+async def drive(client, send, concurrency: int, requests: int):
+    latencies, errors = [], 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            start = time.perf_counter()
+            try:
+                response = await send(client)
+                failed = response.status_code >= 400
+            except httpx.HTTPError:
+                failed = True
+            latencies.append(time.perf_counter() - start)
+            errors += failed
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    percentiles = statistics.quantiles(latencies, n=100)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": len(latencies) / elapsed,
+        "p50_ms": percentiles[49] * 1000,
+        "p95_ms": percentiles[94] * 1000,
+        "p99_ms": percentiles[98] * 1000,
+    }
+
+@asynccontextmanager
+async def open_client(url: str):
+    if url:
+        async with httpx.AsyncClient(base_url=url, timeout=None) as client:
+            yield client
+        return
+    from app.main import socialMediaApp
+    async with socialMediaApp.router.lifespan_context(socialMediaApp):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=socialMediaApp), base_url="http://bench", timeout=None) as client:
+            yield client
+
+async def main(args):
+    rng = random.Random(args.seed)
+    emails, post_ids = load_fixtures(args.tokens)
+    results = {}
+    async with open_client(args.url) as client:
+        headers = []
+        for email in emails[:args.tokens]:
+            token = (await client.post("/login", data={"username": email, "password": PASSWORD})).json()["access_token"]
+            headers.append({"Authorization": f"Bearer {token}"})
+        routes = make_routes(emails, post_ids, headers, args.zipf, rng)
+        for route in args.routes or routes:
+            # warm up pools and caches before measuring
+            await drive(client, routes[route], args.concurrency, args.concurrency)
+            results[route] = await drive(client, routes[route], args.concurrency, args.requests)
+    return {
+        "meta": {
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "target": args.url or "in-process",
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "python": platform.python_version(),
+        },
+        "routes": results,
+    }
+
+def print_report(report, baseline=None):
+    for route, result in report["routes"].items():
+        line = f"{route:<16} {result['throughput']:8.1f} req/s  p50 {result['p50_ms']:7.1f} ms  p95 {result['p95_ms']:7.1f} ms  p99 {result['p99_ms']:7.1f} ms  errors {result['errors']}"
+        before = (baseline or {}).get("routes", {}).get(route)
+        if before:
+            change = lambda key: (result[key] - before[key]) / before[key] * 100 if before[key] else 0
+            line += f"  (throughput {change('throughput'):+.0f}%, p50 {change('p50_ms'):+.0f}%, p99 {change('p99_ms'):+.0f}%)"
+        print(line)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run")
+    parser.add_argument("--url", default=None, help="base URL of a running server; the app runs in-process when omitted")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=1000, help="measured requests per route")
+    parser.add_argument("--routes", nargs="*", choices=["POST /login", "GET /posts", "GET /posts/{id}", "POST /votes"], help="routes to run (default: all)")
+    parser.add_argument("--tokens", type=int, default=50, help="number of seeded users to log in and vote as")
+    parser.add_argument("--zipf", type=float, default=1.1, help="Zipf exponent for picking posts")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help="write the results to this JSON file")
+    parser.add_argument("--baseline", default=None, help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    report = asyncio.run(main(args))
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,72 @@
+import argparse
+import itertools
+import random
+from sqlalchemy import select, update, delete, insert, func
+from app import models, utils
+from app.database import SessionLocal
+from app.votes import hot_score
+
+# Seeds the database with a reproducible data set for benchmarks.run: N users, M posts and
+# K votes. Post authors and voted posts follow a Zipf distribution, so a few users write
+# most posts and a few posts collect most votes, as on a real site. Run with
+# `python -m benchmarks.seed`; the same --seed always produces the same data.
+
+EMAIL_DOMAIN = "bench.example.com"
+PASSWORD = "bench-password"
+WORDS = "the quick brown fox jumps over lazy dog python fastapi postgres index query cache vote post feed user timeline".split()
+
+def bench_email(i: int):
+    return f"user{i}@{EMAIL_DOMAIN}"
+
+def zipf_weights(n: int, s: float):
+    # cumulative weights of ranks 1..n, for random.choices
+    return list(itertools.accumulate(1 / rank ** s for rank in range(1, n + 1)))
+
+def chunked(rows, size):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+def seed(users: int, posts: int, votes: int, zipf: float = 1.1, rng_seed: int = 0, batch_size: int = 5000):
+    rng = random.Random(rng_seed)
+    with SessionLocal() as db:
+        # deleting the users cascades to their posts and votes
+        db.execute(delete(models.User).where(models.User.email.like(f"%@{EMAIL_DOMAIN}")))
+        # every seeded user shares one hash; bcrypt on each of them would dominate seeding
+        password = utils.hashPassword(PASSWORD)
+        user_ids = []
+        for rows in chunked([{"email": bench_email(i), "password": password} for i in range(users)], batch_size):
+            user_ids += db.scalars(insert(models.User).returning(models.User.id, sort_by_parameter_order=True), rows).all()
+
+        authors = rng.choices(user_ids, cum_weights=zipf_weights(len(user_ids), zipf), k=posts)
+        post_ids = []
+        for rows in chunked([{"title": f"bench post {i}", "content": f"seeded post {i} " + " ".join(rng.choices(WORDS, k=20)), "owner_id": author} for i, author in enumerate(authors)], batch_size):
+            post_ids += db.scalars(insert(models.Post).returning(models.Post.id, sort_by_parameter_order=True), rows).all()
+
+        # popular posts collect most votes; a user votes on a post at most once
+        votes = min(votes, len(user_ids) * len(post_ids))
+        weights = zipf_weights(len(post_ids), zipf)
+        pairs = set()
+        while len(pairs) < votes:
+            for post_id in rng.choices(post_ids, cum_weights=weights, k=votes - len(pairs)):
+                pairs.add((rng.choice(user_ids), post_id))
+        for rows in chunked([{"user_id": user_id, "post_id": post_id, "vote_dir": 1} for user_id, post_id in sorted(pairs)], batch_size):
+            db.execute(insert(models.Vote), rows)
+
+        if pairs:
+            # the vote endpoints keep these up to date; seeding writes votes directly
+            counts = select(models.Vote.post_id, func.count().label("votes")).where(models.Vote.post_id.between(post_ids[0], post_ids[-1])).group_by(models.Vote.post_id).subquery()
+            db.execute(update(models.Post).where(models.Post.id == counts.c.post_id).values(
+                votes_count=counts.c.votes, hot_score=hot_score(counts.c.votes, models.Post.created_at),
+            ).execution_options(synchronize_session=False))
+        db.commit()
+    return len(user_ids), len(post_ids), len(pairs)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.seed")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--posts", type=int, default=20000)
+    parser.add_argument("--votes", type=int, default=100000)
+    parser.add_argument("--zipf", type=float, default=1.1, help="Zipf exponent for post authors and voted posts")
+    parser.add_argument("--seed", type=int, default=0, help="random seed; the same seed gives the same data")
+    args = parser.parse_args()
+    print("seeded %d users, %d posts, %d votes" % seed(args.users, args.posts, args.votes, args.zipf, args.seed))
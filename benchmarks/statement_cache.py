@@ -0,0 +1,117 @@
+import argparse
+import asyncio
+import random
+import time
+from sqlalchemy import select, update, func, cast, literal_column, lambda_stmt, Float
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import joinedload
+from app import models, votes
+from app.database import AsyncSessionLocal, async_engine
+from app.instrumentation import statement_cache
+from app.routers.post import feed_statement, SEARCH_CONFIG
+from .seed import EMAIL_DOMAIN
+
+# Per-request CPU cost of the hot queries as the routes used to build them (a new statement
+# per request, one statement shape per vote batch size) against the prebuilt and lambda
+# statements they use now. Reports CPU time of this process per call, which leaves out the
+# database server, and SQLAlchemy's compiled cache hit ratio. Needs benchmarks.seed data.
+# Run with `python -m benchmarks.statement_cache`.
+
+def old_feed(search):
+    query = select(models.Post).options(joinedload(models.Post.owner))
+    sort_key = (models.Post.created_at, models.Post.id)
+    if search:
+        ts_query = func.websearch_to_tsquery(SEARCH_CONFIG, search)
+        query = query.where(models.Post.search_vector.op("@@")(ts_query))
+        sort_key = (cast(func.ts_rank(models.Post.search_vector, ts_query), Float), models.Post.id)
+    query = query.add_columns(*sort_key).order_by(*(column.desc() for column in sort_key))
+    return query.offset(0).limit(11)
+
+async def old_upsert_votes(db, rows):
+    rows = sorted(rows, key=lambda vote: (vote["post_id"], vote["user_id"]))
+    stmt = insert(models.Vote).values(rows)
+    upserted = stmt.on_conflict_do_update(
+        index_elements=[models.Vote.user_id, models.Vote.post_id],
+        set_={"vote_dir": stmt.excluded.vote_dir},
+    ).returning(models.Vote.user_id, models.Vote.post_id, models.Vote.vote_dir, literal_column("xmax = 0").label("inserted")).cte("upserted")
+    added = select(upserted.c.post_id, func.count().label("votes")).where(upserted.c.inserted).group_by(upserted.c.post_id).subquery()
+    counted = update(models.Post).where(models.Post.id == added.c.post_id).values(
+        votes_count=models.Post.votes_count + added.c.votes,
+        hot_score=votes.hot_score(models.Post.votes_count + added.c.votes, models.Post.created_at),
+    ).returning(models.Post.id).cte("counted")
+    return (await db.execute(select(upserted).add_cte(counted))).all()
+
+# the statements get_post and get_current_user run now
+async def post_by_id(db, id):
+    return await db.scalar(lambda_stmt(lambda: select(models.Post).options(joinedload(models.Post.owner)).where(models.Post.id == id)))
+
+async def user_by_id(db, user_id):
+    return await db.scalar(lambda_stmt(lambda: select(models.User).where(models.User.id == user_id)))
+
+def cases(user_ids, post_ids, rng):
+    def vote_batch():
+        # batch sizes vary like POST /votes/batch traffic does
+        return [{"user_id": user_id, "post_id": rng.choice(post_ids), "vote_dir": 1} for user_id in rng.sample(user_ids, rng.randint(1, 20))]
+
+    def dedupe(rows):
+        return list({(row["user_id"], row["post_id"]): row for row in rows}.values())
+
+    return {
+        "feed": (
+            lambda db: db.execute(old_feed(None)),
+            lambda db: db.execute(feed_statement("new", None, False), {"skip": 0, "limit": 11}),
+        ),
+        "feed search": (
+            lambda db: db.execute(old_feed("seeded post")),
+            lambda db: db.execute(feed_statement("relevance", "fulltext", False), {"search": "seeded post", "skip": 0, "limit": 11}),
+        ),
+        "post by id": (
+            lambda db: db.get(models.Post, rng.choice(post_ids), options=[joinedload(models.Post.owner)]),
+            lambda db: post_by_id(db, rng.choice(post_ids)),
+        ),
+        "current user": (
+            lambda db: db.get(models.User, rng.choice(user_ids)),
+            lambda db: user_by_id(db, rng.choice(user_ids)),
+        ),
+        "vote upsert": (
+            lambda db: old_upsert_votes(db, dedupe(vote_batch())),
+            lambda db: votes.upsert_votes(db, dedupe(vote_batch())),
+        ),
+    }
+
+async def measure(call, iterations):
+    async with AsyncSessionLocal() as db:
+        # warm up the connection and the caches
+        for _ in range(10):
+            await call(db)
+            db.expunge_all()
+        hits_before = statement_cache.value(result="hit")
+        misses_before = statement_cache.value(result="miss")
+        cpu, wall = time.process_time(), time.perf_counter()
+        for _ in range(iterations):
+            await call(db)
+            # keep Session.get from answering out of the identity map
+            db.expunge_all()
+        cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+        await db.rollback()
+    hits = statement_cache.value(result="hit") - hits_before
+    misses = statement_cache.value(result="miss") - misses_before
+    return {"cpu_us": cpu / iterations * 1e6, "wall_us": wall / iterations * 1e6, "hit_ratio": hits / (hits + misses) if hits + misses else 0}
+
+async def main(args):
+    rng = random.Random(args.seed)
+    async with AsyncSessionLocal() as db:
+        user_ids = (await db.scalars(select(models.User.id).where(models.User.email.like(f"%@{EMAIL_DOMAIN}")))).all()
+        post_ids = (await db.scalars(select(models.Post.id).where(models.Post.owner_id.in_(user_ids)).limit(1000))).all()
+    if not post_ids:
+        raise SystemExit("no benchmark data, run `python -m benchmarks.seed` first")
+    for name, (before, after) in cases(user_ids, post_ids, rng).items():
+        old, new = await measure(before, args.iterations), await measure(after, args.iterations)
+        print(f"{name:<13} before {old['cpu_us']:7.0f} us cpu, {old['hit_ratio']:4.0%} cache hits   after {new['cpu_us']:7.0f} us cpu, {new['hit_ratio']:4.0%} cache hits   ({(new['cpu_us'] - old['cpu_us']) / old['cpu_us']:+.0%} cpu)")
+    await async_engine.dispose()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.statement_cache")
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,19 @@
+import pytest
+from sqlalchemy import text, exc
+from app.database import SessionLocal
+
+# Tests read their settings from the environment or .env, like the app. Tests marked with the
+# `database` fixture need a migrated Postgres (`alembic upgrade head`) and are skipped without one.
+
+@pytest.fixture
+def anyio_backend():
+    # the app runs on asyncio (asyncpg, the bcrypt pool); tests marked anyio run there too
+    return "asyncio"
+
+@pytest.fixture(scope="session")
+def database():
+    try:
+        with SessionLocal() as db:
+            db.execute(text("SELECT 1"))
+    except exc.OperationalError:
+        pytest.skip("no database to test against")
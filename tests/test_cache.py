@@ -0,0 +1,68 @@
+import asyncio
+import pytest
+import fakeredis
+from app.cache import RedisBackend, ResponseCache
+
+# The redis response cache backend against fakeredis: no redis server needed.
+
+@pytest.fixture
+def client():
+    return fakeredis.FakeAsyncRedis()
+
+@pytest.fixture
+def backend(client):
+    return RedisBackend(ttl=10, client=client)
+
+@pytest.mark.anyio
+async def test_get_returns_what_set_stored(backend, client):
+    assert await backend.get("/posts?limit=10") is None
+    await backend.set("/posts?limit=10", b"[]", ["feed"])
+    assert await backend.get("/posts?limit=10") == b"[]"
+    # keys live under the backend's prefix
+    assert await client.exists("responses:/posts?limit=10")
+    assert await client.smembers("responses:tag:feed") == {b"responses:/posts?limit=10"}
+
+@pytest.mark.anyio
+async def test_entries_and_tags_expire(client):
+    backend = RedisBackend(ttl=0.05, client=client)
+    await backend.set("/posts/1", b"{}", ["post:1"])
+    assert 0 < await client.pttl("responses:/posts/1") <= 50
+    assert 0 < await client.pttl("responses:tag:post:1") <= 50
+    await asyncio.sleep(0.1)
+    assert await backend.get("/posts/1") is None
+    assert not await client.exists("responses:tag:post:1")
+
+@pytest.mark.anyio
+async def test_invalidate_evicts_only_tagged_entries(backend, client):
+    await backend.set("/posts?limit=10", b"[1, 2]", ["feed", "post:1", "post:2"])
+    await backend.set("/posts/1", b"{}", ["post:1"])
+    await backend.set("/posts/3", b"{}", ["post:3"])
+    await backend.invalidate(["post:1"])
+    assert await backend.get("/posts?limit=10") is None
+    assert await backend.get("/posts/1") is None
+    assert await backend.get("/posts/3") == b"{}"
+    assert not await client.exists("responses:tag:post:1")
+    # tags that name nothing are a no-op
+    await backend.invalidate([])
+    await backend.invalidate(["post:404"])
+    assert await backend.get("/posts/3") == b"{}"
+
+@pytest.mark.anyio
+async def test_response_cache_round_trip(backend):
+    cache = ResponseCache(backend)
+    await cache.set("/posts/1", b'{"id": 1}', ["post:1"], headers={"ETag": '"1"'})
+    response = await cache.get("/posts/{id}", "/posts/1")
+    assert response.body == b'{"id": 1}'
+    assert response.headers["ETag"] == '"1"'
+    await cache.invalidate("post:1")
+    assert await cache.get("/posts/{id}", "/posts/1") is None
+
+@pytest.mark.anyio
+async def test_clear_removes_only_prefixed_keys(backend, client):
+    for post_id in range(2500):
+        await backend.set(f"/posts/{post_id}", b"{}", [f"post:{post_id}"])
+    await client.set("sessions:1", b"other data")
+    await backend.clear()
+    assert await backend.get("/posts/1") is None
+    assert await client.keys("responses:*") == []
+    assert await client.get("sessions:1") == b"other data"
@@ -0,0 +1,48 @@
+import pytest
+import httpx
+from sqlalchemy import event, insert, delete
+from app import models
+from app.cache import response_cache
+from app.database import SessionLocal, async_engine
+from app.main import socialMediaApp
+
+EMAIL_DOMAIN = "feed-test.example.com"
+
+@pytest.fixture
+def posts(database):
+    # newer than everything else in the database, so they fill the first page; written by
+    # several owners, so a lazy owner load would cost one query per owner
+    with SessionLocal() as db:
+        owners = db.scalars(insert(models.User).returning(models.User.id, sort_by_parameter_order=True), [{"email": f"owner{i}@{EMAIL_DOMAIN}", "password": "x"} for i in range(10)]).all()
+        db.execute(insert(models.Post), [{"title": f"post {i}", "content": "feed test", "owner_id": owners[i % len(owners)]} for i in range(101)])
+        db.commit()
+    yield
+    with SessionLocal() as db:
+        # deleting the owners cascades to their posts
+        db.execute(delete(models.User).where(models.User.email.like(f"%@{EMAIL_DOMAIN}")))
+        db.commit()
+
+async def count_feed_queries(client, limit):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    # a cached page would cost no query at all
+    await response_cache.clear()
+    event.listen(async_engine.sync_engine, "before_cursor_execute", record)
+    try:
+        response = await client.get("/posts/", params={"limit": limit})
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", record)
+    assert response.status_code == 200
+    assert len(response.json()) == limit
+    return len(statements)
+
+@pytest.mark.anyio
+async def test_feed_query_count_is_constant(posts):
+    # owners are joined in the page query, so the page size must not change the query count
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=socialMediaApp), base_url="http://test") as client:
+        counts = {limit: await count_feed_queries(client, limit) for limit in (1, 10, 100)}
+    await async_engine.dispose()
+    assert counts[1] == counts[10] == counts[100] == 1, counts
@@ -0,0 +1,47 @@
+import asyncio
+import json
+import pytest
+from sqlalchemy import text
+from app import invalidation
+from app.cache import MemoryBackend, response_cache
+from app.config import settings
+from app.database import SessionLocal, SQLALCHEMY_DATABASE_URL
+
+# The invalidation bus end to end: a NOTIFY committed in Postgres reaches a listening worker,
+# which evicts the tagged entries from its memory response cache.
+
+@pytest.fixture
+def backend(monkeypatch):
+    backend = MemoryBackend(maxsize=100, ttl=60)
+    monkeypatch.setattr(response_cache, "backend", backend)
+    return backend
+
+@pytest.fixture
+async def listener(database, monkeypatch):
+    monkeypatch.setattr(settings, "cache_invalidation_enabled", True)
+    listener = invalidation.InvalidationListener(SQLALCHEMY_DATABASE_URL)
+    listener.start()
+    try:
+        async with asyncio.timeout(5):
+            while not listener.connected:
+                await asyncio.sleep(0.01)
+        yield listener
+    finally:
+        await listener.stop()
+
+def notify(*messages):
+    with SessionLocal() as db:
+        for origin, tags in messages:
+            db.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": invalidation.CHANNEL, "payload": json.dumps({"origin": origin, "tags": tags})})
+        db.commit()
+
+@pytest.mark.anyio
+async def test_foreign_notify_evicts_local_entry(backend, listener):
+    await backend.set("/posts/1", b"{}", ["post:1"])
+    await backend.set("/posts/2", b"{}", ["post:2"])
+    # the worker's own messages are skipped: it evicted its entries when it wrote
+    notify((invalidation.WORKER_ID, ["post:2"]), ("another-worker", ["post:1"]))
+    async with asyncio.timeout(5):
+        while await backend.get("/posts/1") is not None:
+            await asyncio.sleep(0.01)
+    assert await backend.get("/posts/2") == b"{}"
@@ -0,0 +1,137 @@
+import json
+import uuid
+import pytest
+import httpx
+from sqlalchemy import event, select, delete, text
+from app import models
+from app.database import SessionLocal, async_engine
+from app.main import socialMediaApp
+from benchmarks.seed import EMAIL_DOMAIN, PASSWORD, seed
+
+# Query plan guard. Sends one request to every route of the in-process app, records each SQL
+# statement they run, and checks the generic plan of each of them, plus the lookups Postgres
+# runs for every ON DELETE CASCADE foreign key, for sequential scans of large tables, i.e. for
+# a missing index. Generic plans are what prepared statements settle on after a few runs, and
+# they don't depend on the parameters of the one request that was recorded.
+#
+# Needs the benchmarks.seed data set; the planner only prefers indexes once tables are big
+# enough. Without one, the fixture seeds the default set and removes it afterwards.
+
+# tables with fewer rows may be scanned sequentially; above the 1000 users of the default seed,
+# below its 20000 posts and 100000 votes
+MIN_ROWS = 10000
+
+@pytest.fixture(scope="module")
+def seeded(database):
+    with SessionLocal() as db:
+        # a plan without an index the models declare says nothing about the app's queries
+        indexes = set(db.scalars(text("SELECT indexname FROM pg_indexes WHERE schemaname = 'public'")))
+        missing = sorted(index.name for table in models.Base.metadata.sorted_tables for index in table.indexes if index.name not in indexes)
+        if missing:
+            pytest.skip(f"database lacks indexes {', '.join(missing)}; migrate it")
+        existing = db.scalar(select(models.User.id).where(models.User.email.like(f"%@{EMAIL_DOMAIN}")).limit(1))
+    if existing is None:
+        seed(users=1000, posts=20000, votes=100000)
+    with SessionLocal() as db:
+        email = db.scalar(select(models.User.email).where(models.User.email.like(f"%@{EMAIL_DOMAIN}")).order_by(models.User.id).limit(1))
+        post_ids = db.scalars(select(models.Post.id).join(models.User).where(models.User.email.like(f"%@{EMAIL_DOMAIN}")).order_by(models.Post.id)).all()
+    yield email, post_ids
+    with SessionLocal() as db:
+        db.execute(delete(models.User).where(models.User.email.like(f"plans-%@{EMAIL_DOMAIN}")))
+        if existing is None:
+            # deleting the users cascades to their posts and votes
+            db.execute(delete(models.User).where(models.User.email.like(f"%@{EMAIL_DOMAIN}")))
+        db.commit()
+
+async def exercise(client, email, post_ids):
+    # every route that touches the database, once; writes clean up after themselves
+    auth = {"Authorization": f"Bearer {(await client.post('/login', data={'username': email, 'password': PASSWORD})).json()['access_token']}"}
+    other = (await client.get(f"/posts/{post_ids[-1]}")).json()["owner_id"]
+    responses = [
+        await client.get("/posts/", params={"limit": 10}),
+        await client.get("/posts/", params={"limit": 10, "sort": "hot"}),
+        await client.get("/posts/", params={"limit": 10, "sort": "top"}),
+        await client.get("/posts/", params={"limit": 10, "sort": "top", "fields": "id,title,owner.email"}),
+        await client.get("/posts/", params={"limit": 10, "search": "seeded post 1234"}),
+        await client.get("/posts/", params={"limit": 10, "search": "quick brown", "search_mode": "substring"}),
+        await client.get(f"/posts/{post_ids[0]}"),
+        await client.post("/posts/lookup", json={"ids": post_ids[:50]}),
+        await client.get("/posts/export", params={"owner_id": other}),
+        await client.get(f"/users/{other}"),
+        await client.get("/timeline/", headers=auth),
+    ]
+    first = await client.get("/posts/", params={"limit": 10, "sort": "hot"})
+    responses.append(await client.get("/posts/", params={"limit": 10, "sort": "hot", "cursor": first.headers["X-Next-Cursor"]}))
+    # revalidations of uncached responses read versions only
+    responses.append(await client.get("/posts/", params={"limit": 10, "sort": "hot", "cursor": first.headers["X-Next-Cursor"]}, headers={"If-None-Match": '"stale"'}))
+    responses.append(await client.get(f"/posts/{post_ids[2]}", headers={"If-None-Match": '"stale"'}))
+
+    post = (await client.post("/posts/", json={"title": "query plans", "content": "query plans"}, headers=auth)).json()
+    bulk = (await client.post("/posts/bulk", content=b'{"title": "query plans", "content": "bulk"}\n', headers={**auth, "Content-Type": "application/x-ndjson"})).json()
+    responses += [
+        await client.put(f"/posts/{post['id']}", json={"title": "query plans", "content": "updated"}, headers=auth),
+        await client.post("/votes/", json={"post_id": post["id"], "vote_dir": 1}, headers=auth),
+        await client.post("/votes/batch", json={"votes": [{"post_id": post_ids[1], "vote_dir": 1}, {"post_id": post["id"], "vote_dir": 0}]}, headers=auth),
+        await client.request("DELETE", "/votes/", json={"post_id": post_ids[1]}, headers=auth),
+        await client.post("/follows/", json={"user_id": other}, headers=auth),
+        await client.request("DELETE", "/follows/", json={"user_id": other}, headers=auth),
+        await client.delete(f"/posts/{post['id']}", headers=auth),
+        *[await client.delete(f"/posts/{id}", headers=auth) for id in bulk["ids"]],
+        await client.post("/users/", json={"email": f"plans-{uuid.uuid4().hex[:8]}@{EMAIL_DOMAIN}", "password": PASSWORD}),
+    ]
+    for response in [first, *responses]:
+        assert response.status_code < 400, f"{response.request.method} {response.request.url.path} failed with {response.status_code}: {response.text}"
+
+def cascade_lookups():
+    # what Postgres runs per deleted parent row for each ON DELETE CASCADE foreign key
+    for table in models.Base.metadata.sorted_tables:
+        for key in table.foreign_keys:
+            if key.ondelete == "CASCADE":
+                yield f"SELECT 1 FROM ONLY {table.name} x WHERE {key.parent.name} = $1 FOR KEY SHARE OF x"
+
+def seq_scans(plan, large):
+    if plan["Node Type"] == "Seq Scan" and plan["Relation Name"] in large:
+        yield plan["Relation Name"]
+    for child in plan.get("Plans", []):
+        yield from seq_scans(child, large)
+
+def generic_plan(db, name, statement):
+    # PREPARE infers the parameter types, as asyncpg's own prepare does; EXECUTE with NULLs then
+    # shows the plan that holds for any parameters
+    db.execute(text(f"PREPARE {name} AS {statement}"))
+    parameters = db.scalar(text("SELECT cardinality(parameter_types) FROM pg_prepared_statements WHERE name = :name"), {"name": name})
+    arguments = f"({', '.join(['NULL'] * parameters)})" if parameters else ""
+    plan = db.scalar(text(f"EXPLAIN (FORMAT JSON) EXECUTE {name}{arguments}"))
+    db.execute(text(f"DEALLOCATE {name}"))
+    return (json.loads(plan) if isinstance(plan, str) else plan)[0]["Plan"]
+
+@pytest.mark.anyio
+async def test_no_sequential_scans_of_large_tables(seeded):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        # executemany batches run the same statement as their single-row form
+        if not executemany and statement.lstrip().split(None, 1)[0].upper() in ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH"):
+            statements.append(statement)
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", record)
+    try:
+        async with socialMediaApp.router.lifespan_context(socialMediaApp):
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=socialMediaApp), base_url="http://test") as client:
+                await exercise(client, *seeded)
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", record)
+
+    failures = []
+    with SessionLocal() as db:
+        # row estimates must be current for the planner, and for deciding which tables are large
+        db.execute(text("ANALYZE"))
+        large = set(db.scalars(text("SELECT relname FROM pg_class WHERE relkind = 'r' AND relnamespace = 'public'::regnamespace AND reltuples >= :rows"), {"rows": MIN_ROWS}))
+        db.execute(text("SET LOCAL plan_cache_mode = force_generic_plan"))
+        for number, statement in enumerate(dict.fromkeys([*statements, *cascade_lookups()])):
+            scanned = sorted(set(seq_scans(generic_plan(db, f"query_plan_{number}", statement), large)))
+            if scanned:
+                failures.append(f"seq scan on {', '.join(scanned)}: {' '.join(statement.split())}")
+        db.rollback()
+    assert large, f"no table holds {MIN_ROWS}+ rows to check"
+    assert not failures, "\n".join(failures)
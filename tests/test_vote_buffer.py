@@ -0,0 +1,166 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+from fastapi import HTTPException
+from app import vote_buffer, votes
+
+# VoteBuffer's acknowledgement semantics, against stubbed statements: no database needed.
+
+class FakeSession:
+    # stands in for AsyncSessionLocal(); posts in `missing` don't exist, and commit() runs `on_commit`
+    def __init__(self, store):
+        self.store = store
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def scalars(self, stmt, params):
+        return [post_id for post_id in params["post_ids"] if post_id not in self.store.missing]
+
+    async def execute(self, stmt, params=None):
+        pass
+
+    async def commit(self):
+        self.store.on_commit()
+        self.store.commits += 1
+
+class Store:
+    # records what the flushes wrote, in place of votes.upsert_votes / votes.delete_votes
+    def __init__(self):
+        self.upserted = []
+        self.deleted = []
+        self.existing_votes = set()
+        self.missing = set()
+        self.commits = 0
+        self.on_commit = lambda: None
+
+    async def upsert_votes(self, db, rows, tags=()):
+        self.upserted += rows
+        return [SimpleNamespace(**row) for row in rows]
+
+    async def delete_votes(self, db, keys):
+        self.deleted += keys
+        return [SimpleNamespace(user_id=user_id, post_id=post_id) for user_id, post_id in keys if (user_id, post_id) in self.existing_votes]
+
+@pytest.fixture
+def store(monkeypatch):
+    store = Store()
+    monkeypatch.setattr(vote_buffer, "AsyncSessionLocal", lambda: FakeSession(store))
+    monkeypatch.setattr(votes, "upsert_votes", store.upsert_votes)
+    monkeypatch.setattr(votes, "delete_votes", store.delete_votes)
+    return store
+
+@pytest.fixture
+def buffer():
+    return vote_buffer.VoteBuffer(flush_seconds=60, flush_size=1000, max_votes=3)
+
+def failing_commit():
+    raise ConnectionError("database is down")
+
+@pytest.mark.anyio
+async def test_last_vote_wins(store, buffer):
+    first, second, other = buffer.add(1, 10, 1), buffer.add(1, 10, 0), buffer.add(2, 10, 1)
+    await buffer.flush()
+    assert sorted(store.upserted, key=lambda row: row["user_id"]) == [
+        {"user_id": 1, "post_id": 10, "vote_dir": 0},
+        {"user_id": 2, "post_id": 10, "vote_dir": 1},
+    ]
+    # the replaced vote is acknowledged along with the one that replaced it
+    assert (first.result(), second.result(), other.result()) == (True, True, True)
+    assert buffer.pending == {} and buffer.waiters == {}
+
+@pytest.mark.anyio
+async def test_removal_overrides_earlier_vote(store, buffer):
+    store.existing_votes.add((1, 10))
+    buffer.add(1, 10, 1)
+    removed = buffer.add(1, 10, None)
+    await buffer.flush()
+    assert store.upserted == []
+    assert store.deleted == [(1, 10)]
+    assert removed.result() is True
+
+@pytest.mark.anyio
+async def test_acknowledged_only_after_commit(store, buffer):
+    futures = [buffer.add(1, 10, 1), buffer.add(2, 11, None)]
+    acknowledged_at_commit = []
+    store.on_commit = lambda: acknowledged_at_commit.extend(future.done() for future in futures)
+    assert not any(future.done() for future in futures)
+    await buffer.flush()
+    assert acknowledged_at_commit == [False, False]
+    assert all(future.done() for future in futures)
+
+@pytest.mark.anyio
+async def test_missing_post_and_vote_are_reported(store, buffer):
+    store.missing.add(10)
+    vote, removal = buffer.add(1, 10, 1), buffer.add(1, 11, None)
+    await buffer.flush()
+    assert (vote.result(), removal.result()) == (False, False)
+
+@pytest.mark.anyio
+async def test_failed_flush_acknowledges_nothing(store, buffer):
+    first = buffer.add(1, 10, 1)
+    other = buffer.add(1, 11, 1)
+
+    def newer_vote_then_fail():
+        # a vote for the same key arrives while the flush is running
+        buffer.add(1, 10, 0)
+        failing_commit()
+
+    store.on_commit = newer_vote_then_fail
+    assert await buffer.flush() is False
+    assert not first.done() and not other.done()
+    # the newer vote wins over the restored one
+    assert buffer.pending == {(1, 10): 0, (1, 11): 1}
+    assert buffer.oldest is not None
+
+    store.on_commit = lambda: None
+    assert await buffer.flush() is True
+    assert first.result() is True and other.result() is True
+    assert store.upserted[-2:] == [{"user_id": 1, "post_id": 10, "vote_dir": 0}, {"user_id": 1, "post_id": 11, "vote_dir": 1}]
+
+@pytest.mark.anyio
+async def test_full_buffer_rejects_new_votes(store, buffer):
+    for post_id in (10, 11, 12):
+        buffer.add(1, post_id, 1)
+    with pytest.raises(HTTPException) as rejected:
+        buffer.add(1, 13, 1)
+    assert rejected.value.status_code == 503
+    assert "Retry-After" in rejected.value.headers
+    # a vote replacing a buffered one takes no room
+    buffer.add(1, 10, 0)
+    assert buffer.pending[1, 10] == 0
+
+@pytest.mark.anyio
+async def test_background_flush_answers_waiting_requests(store):
+    buffer = vote_buffer.VoteBuffer(flush_seconds=0.01, flush_size=1000, max_votes=10)
+    buffer.start()
+    try:
+        assert await asyncio.wait_for(buffer.add(1, 10, 1), 1) is True
+    finally:
+        await buffer.stop()
+    assert store.commits == 1
+
+@pytest.mark.anyio
+async def test_stop_flushes_pending_votes(store, buffer):
+    buffer.start()
+    store.existing_votes.add((2, 11))
+    vote, removal = buffer.add(1, 10, 1), buffer.add(2, 11, None)
+    await buffer.stop()
+    assert store.upserted == [{"user_id": 1, "post_id": 10, "vote_dir": 1}]
+    assert store.deleted == [(2, 11)]
+    assert vote.result() is True and removal.result() is True
+    assert buffer.pending == {}
+    assert buffer.task is None
+
+@pytest.mark.anyio
+async def test_stop_refuses_votes_it_could_not_store(store, buffer):
+    store.on_commit = failing_commit
+    vote = buffer.add(1, 10, 1)
+    await buffer.stop()
+    with pytest.raises(HTTPException) as refused:
+        vote.result()
+    assert refused.value.status_code == 503
+    assert buffer.pending == {} and buffer.waiters == {}